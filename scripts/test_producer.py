@@ -3,7 +3,6 @@
 
 import argparse
 import configparser
-import json
 import logging
 import os
 import random
@@ -13,6 +12,7 @@ from datetime import datetime
 from kafka import KafkaProducer
 
 from snippets.kafka_client import KafkaConfig
+from snippets.kafka_client.serializers import FORMAT_HEADER, check_compression, get_serializer
 
 logger = logging.getLogger(__name__)
 
@@ -20,9 +20,10 @@ logger = logging.getLogger(__name__)
 class KafkaProducerClient:
     def __init__(self, config: KafkaConfig):
         self.config = config.get_config()
+        self.serializer = get_serializer(self.config['serializer'])
         producer_config = {
             'bootstrap_servers': self.config['bootstrap_servers'],
-            'value_serializer': lambda v: json.dumps(v).encode('utf-8'),
+            'value_serializer': self.serializer.dumps,
             'retries': self.config.get('retries'),
             'linger_ms': self.config.get('linger_ms'),
         }
@@ -34,7 +35,7 @@ class KafkaProducerClient:
             'ssl_check_hostname': self.config.get('ssl_check_hostname'),
             'ssl_cafile': self.config.get('ssl_cafile'),
             'acks': self.config.get('acks'),
-            'compression_type': self.config.get('compression_type'),
+            'compression_type': check_compression(self.config.get('compression_type')),
             'batch_size': self.config.get('batch_size'),
             'buffer_memory': self.config.get('buffer_memory'),
             'max_request_size': self.config.get('max_request_size'),
@@ -46,7 +47,8 @@ class KafkaProducerClient:
 
     def send_message(self, message):
         try:
-            self.producer.send(self.config['topic'], message)
+            self.producer.send(self.config['topic'], message,
+                               headers=[(FORMAT_HEADER, self.serializer.format.encode('utf-8'))])
             self.producer.flush()
             logger.info("Message sent to Kafka")
         except Exception as e:
@@ -83,6 +85,8 @@ def read_server_config(config_file):
             ('kafka', 'topic_replication_factor', 'KAFKA_TOPIC_REPLICATION_FACTOR', '1'),
             ('kafka', 'topic_retention_ms', 'KAFKA_TOPIC_RETENTION_MS', '15552000000'),
             ('kafka', 'flush_timeout_s', 'KAFKA_FLUSH_TIMEOUT_S', '60.0'),
+            ('kafka', 'serializer', 'KAFKA_SERIALIZER', 'json'),
+            ('kafka', 'compression_type', 'KAFKA_COMPRESSION_TYPE', ''),
     ):
         if sec not in cfg:
             cfg[sec] = {}
@@ -133,6 +137,8 @@ def main():
         'topic_replication_factor': int(cfg['kafka']['topic_replication_factor']),
         'topic_retention_ms': int(cfg['kafka']['topic_retention_ms']),
         'flush_timeout_s': float(cfg['kafka']['flush_timeout_s']),
+        'serializer': cfg['kafka']['serializer'],
+        'compression_type': cfg['kafka']['compression_type'] or None,
     }
     mq = KafkaConfig(**kafka_args)
     producer = KafkaProducerClient(mq)
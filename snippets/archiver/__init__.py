@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import datetime
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Optional, Tuple
+
+from snippets.database_config.mysql_connector import MySQLConnector
+from snippets.find_by_id import find_id, FIND_ID_LEFT, SEARCH_INTERPOLATE
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched from the server per round trip while streaming a chunk
+FETCH_BATCH_SIZE = 5000
+
+
+class ArchiveStats:
+    """Row counters and per action timings, reported like pt-archiver --statistics."""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.started = datetime.datetime.now()
+        self.ended = None
+        self.why_quit = None
+        self.selected = 0
+        self.inserted = 0
+        self.deleted = 0
+        self.action_counts = {}
+        self.action_times = {}
+        self._start_time = time.monotonic()
+        self._end_time = None
+        self.worker_time = None
+
+    @contextmanager
+    def timed(self, action: str, count: int = 1):
+        """Account the time spent in the block to an action."""
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            self.action_counts[action] = self.action_counts.get(action, 0) + count
+            self.action_times[action] = self.action_times.get(action, 0.0) + time.monotonic() - start_time
+
+    def finish(self, why_quit: str):
+        self.ended = datetime.datetime.now()
+        self._end_time = time.monotonic()
+        self.why_quit = why_quit
+
+    def elapsed(self) -> float:
+        return (self._end_time or time.monotonic()) - self._start_time
+
+    @classmethod
+    def merge(cls, source: str, stats_list) -> 'ArchiveStats':
+        """Combine the statistics of archivers run side by side, timings are summed over workers."""
+        merged = cls(source)
+        stats_list = list(stats_list)
+        if not stats_list:
+            return merged
+        merged.started = min(stats.started for stats in stats_list)
+        merged.ended = max(stats.ended or datetime.datetime.now() for stats in stats_list)
+        merged._start_time = min(stats._start_time for stats in stats_list)
+        merged._end_time = max(stats._end_time or time.monotonic() for stats in stats_list)
+        merged.worker_time = sum(stats.elapsed() for stats in stats_list)
+        for stats in stats_list:
+            merged.selected += stats.selected
+            merged.inserted += stats.inserted
+            merged.deleted += stats.deleted
+            for action, count in stats.action_counts.items():
+                merged.action_counts[action] = merged.action_counts.get(action, 0) + count
+                merged.action_times[action] = merged.action_times.get(action, 0.0) + stats.action_times[action]
+        merged.why_quit = '; '.join(sorted({stats.why_quit for stats in stats_list if stats.why_quit}))
+        return merged
+
+    def report(self) -> str:
+        """Format the statistics the way pt-archiver --statistics prints them."""
+        ended = self.ended or datetime.datetime.now()
+        total = self.worker_time if self.worker_time is not None else self.elapsed()
+        lines = [
+            f"Started at {self.started.isoformat(timespec='seconds')}, "
+            f"ended at {ended.isoformat(timespec='seconds')}",
+            f"Source: {self.source}",
+            f"SELECT {self.selected}",
+            f"INSERT {self.inserted}",
+            f"DELETE {self.deleted}",
+            f"{'Action':<10} {'Count':>10} {'Time':>10} {'Pct':>10}",
+        ]
+        for action in sorted(self.action_times, key=self.action_times.get, reverse=True):
+            action_time = self.action_times[action]
+            lines.append(f"{action:<10} {self.action_counts[action]:>10d} {action_time:>10.4f} "
+                         f"{action_time / total * 100 if total else 0:>10.2f}")
+        other = max(total - sum(self.action_times.values()), 0.0)
+        lines.append(f"{'other':<10} {0:>10d} {other:>10.4f} {other / total * 100 if total else 0:>10.2f}")
+        return '\n'.join(lines)
+
+
+class ArchiveCheckpoint:
+    """Resumable archival progress, persisted as JSON after every committed chunk."""
+
+    def __init__(self, path: str, table_name: str):
+        self.path = path
+        self.table_name = table_name
+
+    def load(self) -> Optional[int]:
+        """Return the last archived ID of the table, or None when there is nothing to resume."""
+        try:
+            with open(self.path, 'r') as file_:
+                state = json.load(file_)
+        except FileNotFoundError:
+            return None
+        except (ValueError, OSError) as e:
+            logger.warning(f"Ignoring unreadable checkpoint {self.path}: {e}")
+            return None
+        if state.get('table') != self.table_name:
+            logger.warning(f"Ignoring checkpoint {self.path} of table {state.get('table')}")
+            return None
+        return state['last_id']
+
+    def save(self, last_id: int, stats: ArchiveStats):
+        state = {
+            'table': self.table_name,
+            'last_id': last_id,
+            'selected': stats.selected,
+            'deleted': stats.deleted,
+            'updated_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as file_:
+            json.dump(state, file_)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class OutfileSink:
+    """Writes archived rows like pt-archiver --file, in SELECT INTO OUTFILE format."""
+
+    _ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\0': '\\0'})
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _format(self, value) -> str:
+        if value is None:
+            return '\\N'
+        if isinstance(value, (bytes, bytearray)):
+            value = value.decode('utf-8', errors='backslashreplace')
+        return str(value).translate(self._ESCAPES)
+
+    def write(self, columns, rows):
+        self._file.writelines('\t'.join(self._format(value) for value in row) + '\n' for row in rows)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def replica_lag(replica) -> Optional[int]:
+    """Return the replication lag in seconds of a replica connection, None when replication is not running."""
+    cursor = replica.cursor()
+    try:
+        try:
+            cursor.execute('SHOW REPLICA STATUS')
+        except Exception:
+            cursor.execute('SHOW SLAVE STATUS')
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        status = dict(zip([column[0] for column in cursor.description], row))
+    finally:
+        cursor.close()
+    return status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+
+
+def resolve_id_range(
+        connector: MySQLConnector,
+        table_name: str,
+        before: Optional[datetime.datetime] = None,
+        index=None
+) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Return the (min_id, max_id) range of rows to archive.
+
+    Without `before` the range covers the whole table as it is now, otherwise
+    it ends at the last row created before that time, located with find_id.
+    """
+    with connector.transaction() as cursor:
+        cursor.execute(f"SELECT MIN(id), MAX(id) FROM {table_name}")
+        min_id, max_id = cursor.fetchone()
+        if min_id is None or before is None:
+            return min_id, max_id
+        first_kept_id = find_id(cursor, table_name, before, FIND_ID_LEFT, SEARCH_INTERPOLATE, index=index)
+    return min_id, (first_kept_id - 1 if first_kept_id is not None else max_id)
+
+
+class Archiver:
+    """
+    Archives and purges the rows of a table in primary key chunks.
+
+    Each chunk is selected, optionally written to a sink, deleted and committed
+    in one transaction, then the checkpoint is saved. Chunks are selected with
+    the session time zone at UTC, so TIMESTAMP columns such as create_time
+    reach the sink in UTC, like find_id compares them. The chunk size is tuned
+    after every chunk towards target_chunk_seconds, and when a replica connection
+    is given archival pauses and shrinks the chunks while its lag exceeds
+    max_replica_lag. Archivers sharing a replica connection across threads
+    pass the same replica_lock, a connection serving one query at a time.
+    """
+
+    def __init__(
+            self,
+            connector: MySQLConnector,
+            table_name: str,
+            min_id: int,
+            max_id: int,
+            purge: bool = True,
+            sink=None,
+            checkpoint: Optional[ArchiveCheckpoint] = None,
+            chunk_size: int = 1000,
+            min_chunk_size: int = 100,
+            max_chunk_size: int = 50000,
+            target_chunk_seconds: float = 0.5,
+            replica=None,
+            max_replica_lag: float = 10.0,
+            lag_check_interval: float = 1.0,
+            replica_lock=None,
+            progress: int = 100000,
+            source: Optional[str] = None,
+            partition: Optional[str] = None,
+            rate_limiter=None,
+            name: Optional[str] = None
+    ):
+        self.connector = connector
+        self.table_name = table_name
+        self.min_id = min_id
+        self.max_id = max_id
+        self.purge = purge
+        self.sink = sink
+        self.checkpoint = checkpoint
+        self.chunk_size = chunk_size
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.target_chunk_seconds = target_chunk_seconds
+        self.replica = replica
+        self.max_replica_lag = max_replica_lag
+        self.lag_check_interval = lag_check_interval
+        self.replica_lock = replica_lock
+        self.progress = progress
+        self.partition = partition
+        self.rate_limiter = rate_limiter
+        self.name = name or table_name
+        self.stats = ArchiveStats(source or f"t={table_name}")
+        self.last_id = None
+
+    def _table_reference(self) -> str:
+        if self.partition is None:
+            return self.table_name
+        return f"{self.table_name} PARTITION (`{self.partition}`)"
+
+    def _next_chunk_size(self, elapsed: float) -> int:
+        """Scale the chunk size towards the target latency, at most doubling or halving it."""
+        factor = min(max(self.target_chunk_seconds / max(elapsed, 1e-3), 0.5), 2.0)
+        return int(min(max(self.chunk_size * factor, self.min_chunk_size), self.max_chunk_size))
+
+    def _wait_for_replica(self):
+        if self.replica is None:
+            return
+        while True:
+            with self.stats.timed('check_lag'), self.replica_lock or nullcontext():
+                lag = replica_lag(self.replica)
+            if lag is not None and lag <= self.max_replica_lag:
+                return
+            self.chunk_size = max(self.chunk_size // 2, self.min_chunk_size)
+            logger.info(f"Replica lag {lag}s exceeds {self.max_replica_lag}s, "
+                        f"pausing with chunk size {self.chunk_size}")
+            with self.stats.timed('sleep'):
+                time.sleep(self.lag_check_interval)
+
+    def _archive_chunk(self, last_id: int) -> Optional[int]:
+        """Archive the next chunk after last_id and return its last ID, None when no rows are left."""
+        columns = '*' if self.sink is not None else 'id'
+        with self.connector.transaction() as cursor:
+            with self.stats.timed('select'):
+                # Pooled connections reset their session settings, so it is set for every chunk
+                cursor.execute("SET @@SESSION.time_zone = '+0:00'")
+                cursor.execute(
+                    f"SELECT {columns} FROM {self._table_reference()} WHERE id > %s AND id <= %s "
+                    f"ORDER BY id LIMIT %s",
+                    (last_id, self.max_id, self.chunk_size)
+                )
+                column_names = [column[0] for column in cursor.description]
+                id_column = column_names.index('id')
+            # Rows are streamed from the unbuffered cursor and handed to the sink batch by batch
+            chunk_last_id, chunk_rows = None, 0
+            while True:
+                with self.stats.timed('select', 0):
+                    rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+                if not rows:
+                    break
+                chunk_last_id = rows[-1][id_column]
+                chunk_rows += len(rows)
+                self.stats.selected += len(rows)
+                if self.sink is not None:
+                    with self.stats.timed('print_file', len(rows)):
+                        self.sink.write(column_names, rows)
+            if chunk_last_id is None:
+                return None
+            if self.sink is not None:
+                # The archived rows must be on disk before the chunk is deleted and checkpointed
+                with self.stats.timed('print_file', 0):
+                    self.sink.flush()
+            if self.purge:
+                with self.stats.timed('deleting', chunk_rows):
+                    cursor.execute(f"DELETE FROM {self._table_reference()} WHERE id > %s AND id <= %s",
+                                   (last_id, chunk_last_id))
+                    self.stats.deleted += cursor.rowcount
+            with self.stats.timed('commit'):
+                cursor.execute('COMMIT')
+        return chunk_last_id
+
+    def run(self) -> ArchiveStats:
+        """Archive the ID range and return the statistics."""
+        last_id = self.min_id - 1
+        resumed_id = self.checkpoint.load() if self.checkpoint is not None else None
+        if resumed_id is not None and resumed_id > last_id:
+            logger.info(f"Resuming {self.name} archival after ID {resumed_id}")
+            last_id = resumed_id
+        self.last_id = last_id
+
+        next_progress = self.progress
+        why_quit = 'Exiting because there are no more rows.'
+        try:
+            while last_id < self.max_id:
+                self._wait_for_replica()
+                start_time = time.monotonic()
+                selected = self.stats.selected
+                chunk_last_id = self._archive_chunk(last_id)
+                if chunk_last_id is None:
+                    break
+                last_id = self.last_id = chunk_last_id
+                if self.checkpoint is not None:
+                    self.checkpoint.save(last_id, self.stats)
+                self.chunk_size = self._next_chunk_size(time.monotonic() - start_time)
+                if self.rate_limiter is not None:
+                    with self.stats.timed('throttle'):
+                        self.rate_limiter.acquire(self.stats.selected - selected)
+                if self.progress and self.stats.selected >= next_progress:
+                    logger.info(f"{self.name} {datetime.datetime.now().isoformat(timespec='seconds')} "
+                                f"{int(self.stats.elapsed()):>7} {self.stats.selected:>7} "
+                                f"(last id {last_id}, chunk size {self.chunk_size})")
+                    next_progress += self.progress
+        except KeyboardInterrupt:
+            why_quit = 'Exiting because of an interrupt, resume from the checkpoint.'
+            raise
+        except Exception as e:
+            why_quit = f"Exiting because of an error: {e}"
+            raise
+        finally:
+            self.stats.finish(why_quit)
+            if self.sink is not None:
+                self.sink.close()
+        if self.checkpoint is not None:
+            self.checkpoint.clear()
+        return self.stats
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional
+
+from snippets.archiver import Archiver, ArchiveCheckpoint, ArchiveStats
+from snippets.database_config.mysql_connector import MySQLConnector
+from snippets.find_by_id import find_ids, FIND_ID_LEFT
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveSlice:
+    """An ID range archived by one worker, optionally restricted to one partition."""
+
+    def __init__(self, name: str, min_id: int, max_id: int, partition: Optional[str] = None):
+        self.name = name
+        self.min_id = min_id
+        self.max_id = max_id
+        self.partition = partition
+
+    def __repr__(self):
+        return f"ArchiveSlice({self.name!r}, {self.min_id}, {self.max_id}, partition={self.partition!r})"
+
+
+class SlicePlan:
+    """
+    The slices of an archival run, persisted next to their checkpoints.
+
+    Slices are derived from the rows left in the table, so a run resumed
+    after rows were purged would get other bounds and names and never find
+    its checkpoints; the slices of the first run are reused until the run
+    completes.
+    """
+
+    def __init__(self, path: str, table_name: str):
+        self.path = path
+        self.table_name = table_name
+
+    def load(self, slice_by: str) -> Optional[List[ArchiveSlice]]:
+        """Return the saved slices of the table, or None when there is no run to resume."""
+        try:
+            with open(self.path, 'r') as file_:
+                state = json.load(file_)
+        except FileNotFoundError:
+            return None
+        except (ValueError, OSError) as e:
+            logger.warning(f"Ignoring unreadable slice plan {self.path}: {e}")
+            return None
+        if state.get('table') != self.table_name or state.get('slice_by') != slice_by:
+            logger.warning(f"Ignoring slice plan {self.path} of table {state.get('table')} "
+                           f"sliced by {state.get('slice_by')}")
+            return None
+        return [ArchiveSlice(item['name'], item['min_id'], item['max_id'], item['partition'])
+                for item in state['slices']]
+
+    def save(self, slice_by: str, slices: List[ArchiveSlice]):
+        state = {
+            'table': self.table_name,
+            'slice_by': slice_by,
+            'slices': [
+                {'name': item.name, 'min_id': item.min_id, 'max_id': item.max_id, 'partition': item.partition}
+                for item in slices
+            ],
+            'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as file_:
+            json.dump(state, file_)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class RateLimiter:
+    """Shared rows per second budget; callers sleep until the rows they used fit in the budget."""
+
+    def __init__(self, rows_per_second: float):
+        self.rows_per_second = rows_per_second
+        self._lock = threading.Lock()
+        self._next_free = time.monotonic()
+
+    def acquire(self, rows: int):
+        with self._lock:
+            now = time.monotonic()
+            self._next_free = max(self._next_free, now) + rows / self.rows_per_second
+            wait = self._next_free - now - 1.0  # Allow one second of burst
+        if wait > 0:
+            time.sleep(wait)
+
+
+def even_slices(min_id: int, max_id: int, count: int) -> List[ArchiveSlice]:
+    """Split an ID range into count contiguous slices of equal width."""
+    width = max((max_id - min_id + count) // count, 1)
+    return [
+        ArchiveSlice(f"ids-{lo_id}", lo_id, min(lo_id + width - 1, max_id))
+        for lo_id in range(min_id, max_id + 1, width)
+    ]
+
+
+def partition_slices(connector: MySQLConnector, table_name: str, min_id: int, max_id: int) -> List[ArchiveSlice]:
+    """One slice per table partition holding rows of the ID range."""
+    with connector.transaction() as cursor:
+        cursor.execute(
+            """
+            SELECT PARTITION_NAME FROM information_schema.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+            ORDER BY PARTITION_ORDINAL_POSITION
+            """,
+            (table_name,)
+        )
+        partitions = [row[0] for row in cursor.fetchall()]
+        if not partitions:
+            return []
+        subquery = "(SELECT %s, MIN(id), MAX(id) FROM {table} PARTITION (`{partition}`) WHERE id >= %s AND id <= %s)"
+        query = " UNION ALL ".join(subquery.format(table=table_name, partition=partition) for partition in partitions)
+        cursor.execute(query, tuple(param for partition in partitions for param in (partition, min_id, max_id)))
+        ranges = cursor.fetchall()
+    return [
+        ArchiveSlice(partition, lo_id, hi_id, partition)
+        for partition, lo_id, hi_id in ranges if lo_id is not None
+    ]
+
+
+def day_slices(connector: MySQLConnector, table_name: str, min_id: int, max_id: int,
+               index=None) -> List[ArchiveSlice]:
+    """One slice per UTC day of create_time, the day boundaries located with find_ids."""
+    with connector.transaction() as cursor:
+        cursor.execute("SET @@SESSION.time_zone = '+0:00'")
+        cursor.execute(
+            f"""
+            (SELECT UNIX_TIMESTAMP(create_time) FROM {table_name} WHERE id >= %s ORDER BY id ASC LIMIT 1)
+            UNION ALL
+            (SELECT UNIX_TIMESTAMP(create_time) FROM {table_name} WHERE id <= %s ORDER BY id DESC LIMIT 1)
+            """,
+            (min_id, max_id)
+        )
+        times = [int(row[0]) for row in cursor.fetchall()]
+        if not times:
+            return []
+        first_day = datetime.datetime.fromtimestamp(times[0], datetime.timezone.utc).replace(
+            hour=0, minute=0, second=0, microsecond=0)
+        last_time = datetime.datetime.fromtimestamp(times[-1], datetime.timezone.utc)
+        days = []
+        day = first_day + datetime.timedelta(days=1)
+        while day <= last_time:
+            days.append(day)
+            day += datetime.timedelta(days=1)
+        boundaries = find_ids(cursor, table_name, days, FIND_ID_LEFT, index=index)
+
+    slices = []
+    lo_id, lo_day = min_id, first_day
+    for day in days:
+        boundary = boundaries[day]
+        if boundary is None or boundary > max_id:
+            break
+        if boundary > lo_id:
+            slices.append(ArchiveSlice(lo_day.strftime('%Y-%m-%d'), lo_id, boundary - 1))
+            lo_id = boundary
+        lo_day = day
+    slices.append(ArchiveSlice(lo_day.strftime('%Y-%m-%d'), lo_id, max_id))
+    return slices
+
+
+class ParallelArchiver:
+    """
+    Archives slices of a table concurrently, one Archiver per slice.
+
+    At most `workers` slices run at a time, each on its own pooled connection
+    and with its own checkpoint, and all of them share one rows per second
+    budget. A replica connection in archiver_options is shared as well, its
+    lag checks taking turns. Every progress_interval seconds the progress of
+    each running slice is logged.
+    """
+
+    def __init__(
+            self,
+            connector: MySQLConnector,
+            table_name: str,
+            slices: List[ArchiveSlice],
+            workers: int = 4,
+            rows_per_second: Optional[float] = None,
+            checkpoint_dir: Optional[str] = None,
+            progress_interval: float = 30.0,
+            source: Optional[str] = None,
+            sink_factory=None,
+            **archiver_options
+    ):
+        self.connector = connector
+        self.table_name = table_name
+        self.slices = slices
+        self.workers = workers
+        self.rate_limiter = RateLimiter(rows_per_second) if rows_per_second else None
+        self.checkpoint_dir = checkpoint_dir
+        self.progress_interval = progress_interval
+        self.source = source or f"t={table_name}"
+        self.sink_factory = sink_factory
+        self.archiver_options = archiver_options
+        self.replica_lock = threading.Lock()
+        self.archivers = []
+        self.stats = None
+        self._stop = threading.Event()
+
+    def _archiver(self, archive_slice: ArchiveSlice) -> Archiver:
+        checkpoint = None
+        if self.checkpoint_dir is not None:
+            checkpoint = ArchiveCheckpoint(
+                os.path.join(self.checkpoint_dir, f"checkpoint-{self.table_name}-{archive_slice.name}.json"),
+                self.table_name
+            )
+        return Archiver(
+            self.connector,
+            self.table_name,
+            archive_slice.min_id,
+            archive_slice.max_id,
+            sink=self.sink_factory(archive_slice) if self.sink_factory is not None else None,
+            checkpoint=checkpoint,
+            source=self.source,
+            partition=archive_slice.partition,
+            rate_limiter=self.rate_limiter,
+            name=f"{self.table_name}[{archive_slice.name}]",
+            replica_lock=self.replica_lock,
+            **self.archiver_options
+        )
+
+    def _report_progress(self):
+        while not self._stop.wait(self.progress_interval):
+            for archiver in self.archivers:
+                if archiver.last_id is None or archiver.stats.ended is not None:
+                    continue
+                elapsed = archiver.stats.elapsed()
+                logger.info(f"{archiver.name}: {archiver.stats.selected} rows, last id {archiver.last_id} "
+                            f"of {archiver.max_id}, {archiver.stats.selected / max(elapsed, 1e-3):.0f} rows/s, "
+                            f"chunk size {archiver.chunk_size}")
+
+    def run(self) -> ArchiveStats:
+        """Archive all slices and return the combined statistics."""
+        self.archivers = [self._archiver(archive_slice) for archive_slice in self.slices]
+        reporter = threading.Thread(target=self._report_progress, name='archive-progress', daemon=True)
+        reporter.start()
+        errors = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='archiver') as executor:
+                futures = {executor.submit(archiver.run): archiver for archiver in self.archivers}
+                for future in as_completed(futures):
+                    archiver = futures[future]
+                    try:
+                        stats = future.result()
+                        logger.info(f"{archiver.name} done: {stats.selected} rows in {stats.elapsed():.1f}s")
+                    except Exception as e:
+                        logger.error(f"{archiver.name} failed: {e}")
+                        errors.append(e)
+        finally:
+            self._stop.set()
+            reporter.join()
+            self.stats = ArchiveStats.merge(self.source, [archiver.stats for archiver in self.archivers])
+        if errors:
+            raise errors[0]
+        return self.stats
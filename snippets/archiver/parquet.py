@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import datetime
+import json
+import logging
+import os
+import threading
+from typing import Iterator, List, Optional
+
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.jsonl'
+
+_manifest_lock = threading.Lock()
+
+
+def _isoformat(value) -> Optional[str]:
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return None if value is None else str(value)
+
+
+class ParquetSink:
+    """
+    Writes archived rows as zstd compressed Parquet chunk files.
+
+    The rows written between two flushes, i.e. one archived chunk, become one
+    file named after its ID range. Column statistics are kept in the Parquet
+    footer, and the id and create_time bounds of every file are appended to a
+    manifest.jsonl in the same directory, so restores and audits can pick the
+    files they need without opening the others. Archiver selects create_time
+    in UTC, the manifest bounds are naive UTC.
+    """
+
+    def __init__(
+            self,
+            directory: str,
+            table_name: str,
+            compression: str = 'zstd',
+            compression_level: Optional[int] = None
+    ):
+        self.directory = directory
+        self.table_name = table_name
+        self.compression = compression
+        self.compression_level = compression_level
+        self.files_written = 0
+        self._columns = None
+        self._rows = []
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, columns, rows):
+        if self._columns is None:
+            self._columns = list(columns)
+        self._rows.extend(rows)
+
+    def flush(self):
+        """Write the rows buffered since the last flush to a chunk file."""
+        if not self._rows:
+            return
+        frame = pl.DataFrame(self._rows, schema=self._columns, orient='row', infer_schema_length=None)
+        self._rows = []
+        min_id, max_id = frame['id'].min(), frame['id'].max()
+        name = f"{self.table_name}-{min_id:012d}-{max_id:012d}.parquet"
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.tmp"
+        frame.write_parquet(
+            tmp_path,
+            compression=self.compression,
+            compression_level=self.compression_level,
+            statistics=True,
+        )
+        os.replace(tmp_path, path)
+
+        entry = {
+            'file': name,
+            'table': self.table_name,
+            'rows': frame.height,
+            'min_id': min_id,
+            'max_id': max_id,
+            'min_create_time': None,
+            'max_create_time': None,
+            'bytes': os.path.getsize(path),
+            'written_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        }
+        if 'create_time' in frame.columns:
+            entry['min_create_time'] = _isoformat(frame['create_time'].min())
+            entry['max_create_time'] = _isoformat(frame['create_time'].max())
+        with _manifest_lock:
+            with open(os.path.join(self.directory, MANIFEST_NAME), 'a') as file_:
+                file_.write(json.dumps(entry) + '\n')
+        self.files_written += 1
+        logger.info(f"Wrote {entry['rows']} rows of {self.table_name} with IDs {min_id}-{max_id} to {path}")
+
+    def close(self):
+        self.flush()
+
+
+def read_manifest(directory: str) -> Iterator[dict]:
+    """
+    Yield the manifest entries of the chunk files in a directory.
+
+    A file written again, e.g. by a rerun over the same ID range, is listed
+    once, with its latest entry.
+    """
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return
+    entries = {}
+    with open(path, 'r') as file_:
+        for line in file_:
+            if line.strip():
+                entry = json.loads(line)
+                entries.pop(entry['file'], None)
+                entries[entry['file']] = entry
+    yield from entries.values()
+
+
+def _utc(value) -> datetime.datetime:
+    """An aware UTC datetime of a datetime or ISO text, naive ones being UTC like archived create_time."""
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value.astimezone(datetime.timezone.utc)
+
+
+def select_files(
+        directory: str,
+        min_id: Optional[int] = None,
+        max_id: Optional[int] = None,
+        since: Optional[datetime.datetime] = None,
+        until: Optional[datetime.datetime] = None
+) -> List[str]:
+    """
+    Return the paths of the chunk files which may hold rows in the ID and create_time ranges.
+
+    since and until may be naive, meaning UTC, or aware.
+    """
+    since = _utc(since) if since is not None else None
+    until = _utc(until) if until is not None else None
+    paths = []
+    for entry in read_manifest(directory):
+        if min_id is not None and entry['max_id'] < min_id:
+            continue
+        if max_id is not None and entry['min_id'] > max_id:
+            continue
+        if since is not None and entry['max_create_time'] is not None \
+                and _utc(entry['max_create_time']) < since:
+            continue
+        if until is not None and entry['min_create_time'] is not None \
+                and _utc(entry['min_create_time']) > until:
+            continue
+        paths.append(os.path.join(directory, entry['file']))
+    return paths
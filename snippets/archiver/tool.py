@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import configparser
+import datetime
+import logging
+import os
+import sys
+
+import mysql.connector
+
+from snippets.archiver import Archiver, ArchiveCheckpoint, OutfileSink, resolve_id_range
+from snippets.archiver.parallel import ParallelArchiver, SlicePlan, day_slices, even_slices, partition_slices
+from snippets.archiver.parquet import ParquetSink
+from snippets.database_config import MySQLConfig
+from snippets.database_config.mysql_connector import MySQLConnector
+from snippets.find_by_id.index import TimeIdIndex, index_path
+from snippets.utils import parse_bool
+
+logger = logging.getLogger(__name__)
+
+
+def read_server_config(config_file):
+    cfg = configparser.ConfigParser()
+    cfg.read(config_file)
+
+    for sec, key, envkey, val in (
+            ('mysql', 'host', 'MYSQL_HOST', '127.0.0.1'),
+            ('mysql', 'port', 'MYSQL_PORT', '3306'),
+            ('mysql', 'user', 'MYSQL_USER', 'root'),
+            ('mysql', 'password', 'MYSQL_PASSWORD', 'root'),
+            ('mysql', 'database', 'MYSQL_DATABASE', 'sma'),
+            ('replica', 'host', 'MYSQL_REPLICA_HOST', ''),
+            ('replica', 'port', 'MYSQL_REPLICA_PORT', '3306'),
+            ('archive', 'table', 'ARCHIVE_TABLE', 'meter_sample'),
+            ('archive', 'purge', 'ARCHIVE_PURGE', 'true'),
+            ('archive', 'log_dir', 'ARCHIVE_LOG_DIR', '/opt/backup/ptarchiver_log'),
+    ):
+        if sec not in cfg:
+            cfg[sec] = {}
+        if key not in cfg[sec]:
+            cfg[sec][key] = str(os.environ.get(envkey, val))
+    return cfg
+
+
+def parse_command_line():
+    """Parse command line."""
+    parser = argparse.ArgumentParser(
+        description='Archive and purge table rows in adaptive primary key chunks',
+    )
+    parser.add_argument('--debug', action='store_true', help='Enable logging a debug level and above')
+    parser.add_argument('--config-file', default='archiver.conf', help='Configuration file')
+    parser.add_argument('--table', help='Table to archive, overrides the configuration file')
+    bound = parser.add_mutually_exclusive_group()
+    bound.add_argument('--before', help='Archive rows created before this UTC datetime (YYYY-MM-DD HH:MM:SS)')
+    bound.add_argument('--older-than-days', type=int, help='Archive rows created more than this many days ago')
+    bound.add_argument('--max-id', type=int, help='Archive rows up to this ID')
+    parser.add_argument('--min-id', type=int, help='Archive rows from this ID, defaults to MIN(id)')
+    parser.add_argument('--no-delete', action='store_true', help='Copy rows out without purging them')
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('--file', help='Append archived rows to this file, like pt-archiver --file')
+    output.add_argument('--parquet-dir', help='Write archived rows as zstd Parquet chunk files to this directory')
+    parser.add_argument('--checkpoint-file', help='Checkpoint file, defaults to one per table in the log dir')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Initial rows per chunk')
+    parser.add_argument('--max-chunk-size', type=int, default=50000, help='Upper bound of rows per chunk')
+    parser.add_argument('--target-chunk-seconds', type=float, default=0.5,
+                        help='Per chunk latency the chunk size is tuned towards')
+    parser.add_argument('--max-lag', type=float, default=10.0, help='Pause while the replica lags more seconds')
+    parser.add_argument('--progress', type=int, default=100000, help='Log progress every this many rows')
+    parser.add_argument('--statistics', action='store_true', help='Print statistics like pt-archiver --statistics')
+    parser.add_argument('--workers', type=int, default=1, help='Slices archived concurrently')
+    parser.add_argument('--slice-by', choices=('ids', 'day', 'partition'), default='ids',
+                        help='How the ID range is split between workers')
+    parser.add_argument('--rows-per-second', type=float, help='Rows per second budget shared by all workers')
+    parser.add_argument('--progress-interval', type=float, default=30.0,
+                        help='Seconds between per worker progress reports')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_command_line()
+    logging.basicConfig(format="%(asctime)s  %(levelname)-5s  %(message)s",
+                        level=logging.DEBUG if args.debug else logging.INFO)
+    cfg = read_server_config(args.config_file)
+    table_name = args.table or cfg['archive']['table']
+    log_dir = cfg['archive']['log_dir']
+
+    db_args = {
+        'host': cfg['mysql']['host'],
+        'port': int(cfg['mysql']['port']),
+        'user': cfg['mysql']['user'],
+        'password': cfg['mysql']['password'],
+        'database': cfg['mysql']['database'],
+        'pool_name': f"archiver-{table_name}",
+        'pool_size': min(max(args.workers + 1, 5), 32),
+    }
+    connector = MySQLConnector(MySQLConfig(**db_args))
+
+    before = None
+    if args.before:
+        before = datetime.datetime.strptime(args.before, "%Y-%m-%d %H:%M:%S").replace(tzinfo=datetime.timezone.utc)
+    elif args.older_than_days is not None:
+        before = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=args.older_than_days)
+
+    index = TimeIdIndex(index_path(log_dir, table_name))
+    try:
+        if before is not None:
+            with connector.transaction() as cursor:
+                index.refresh(cursor, table_name)
+        min_id, max_id = resolve_id_range(connector, table_name, before, index)
+    finally:
+        index.close()
+    if args.min_id is not None:
+        min_id = args.min_id
+    if args.max_id is not None:
+        max_id = args.max_id
+    if min_id is None or max_id is None:
+        logger.error(f"Unable to determine ID range for archival of {table_name}.")
+        sys.exit(1)
+    logger.info(f"Archiving {table_name} with ID range from {min_id} to {max_id}")
+
+    replica = None
+    if cfg['replica']['host']:
+        replica = mysql.connector.connect(
+            host=cfg['replica']['host'],
+            port=int(cfg['replica']['port']),
+            user=db_args['user'],
+            password=db_args['password'],
+        )
+
+    archiver_options = {
+        'purge': parse_bool(cfg['archive']['purge']) and not args.no_delete,
+        'chunk_size': args.chunk_size,
+        'max_chunk_size': args.max_chunk_size,
+        'target_chunk_seconds': args.target_chunk_seconds,
+        'replica': replica,
+        'max_replica_lag': args.max_lag,
+        'progress': args.progress,
+        'source': f"D={db_args['database']},t={table_name}",
+    }
+
+    def sink_factory(archive_slice):
+        if args.parquet_dir:
+            return ParquetSink(args.parquet_dir, table_name)
+        if args.file:
+            return OutfileSink(f"{args.file}.{archive_slice.name}" if archive_slice is not None else args.file)
+        return None
+
+    plan = None
+    if args.workers > 1 or args.rows_per_second:
+        checkpoint_dir = os.path.dirname(args.checkpoint_file) if args.checkpoint_file else log_dir
+        plan = SlicePlan(os.path.join(checkpoint_dir, f"slices-{table_name}.json"), table_name)
+        slices = plan.load(args.slice_by)
+        if slices is not None:
+            logger.info(f"Resuming the slices of {plan.path}")
+        else:
+            if args.slice_by == 'partition':
+                slices = partition_slices(connector, table_name, min_id, max_id)
+            elif args.slice_by == 'day':
+                slices = day_slices(connector, table_name, min_id, max_id)
+            else:
+                slices = even_slices(min_id, max_id, args.workers * 4)
+            plan.save(args.slice_by, slices)
+        logger.info(f"Archiving {len(slices)} slices with {args.workers} workers")
+        archiver = ParallelArchiver(
+            connector,
+            table_name,
+            slices,
+            workers=args.workers,
+            rows_per_second=args.rows_per_second,
+            checkpoint_dir=checkpoint_dir,
+            progress_interval=args.progress_interval,
+            sink_factory=sink_factory,
+            **archiver_options
+        )
+    else:
+        archiver = Archiver(
+            connector,
+            table_name,
+            min_id,
+            max_id,
+            sink=sink_factory(None),
+            checkpoint=ArchiveCheckpoint(
+                args.checkpoint_file or os.path.join(log_dir, f"checkpoint-{table_name}.json"), table_name
+            ),
+            **archiver_options
+        )
+    try:
+        stats = archiver.run()
+        if plan is not None:
+            # Every slice completed and cleared its checkpoint
+            plan.clear()
+    finally:
+        if replica is not None:
+            replica.close()
+        if archiver.stats is not None:
+            if args.statistics:
+                print(archiver.stats.report())
+            print(archiver.stats.why_quit)
+    logger.info(f"Archived {stats.selected} rows of {table_name} in {stats.elapsed():.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,7 @@
 
 class MySQLConfig:
     def __init__(self, host, port, user, password, database,
-                 pool_name='database-pool-01', pool_size=5):
+                 pool_name='database-pool-01', pool_size=5, allow_local_infile=False):
         self.host = host
         self.port = port
         self.user = user
@@ -11,6 +11,7 @@ class MySQLConfig:
         self.database = database
         self.pool_name = pool_name
         self.pool_size = pool_size
+        self.allow_local_infile = allow_local_infile
 
     def get_config(self):
         return {
@@ -20,5 +21,6 @@ class MySQLConfig:
             'password': self.password,
             'database': self.database,
             'pool_name': self.pool_name,
-            'pool_size': self.pool_size
+            'pool_size': self.pool_size,
+            'allow_local_infile': self.allow_local_infile
         }
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Results with at least this many rows are kept on disk only
+SPILL_ROWS = 10000
+
+# Quoted literals and identifiers, kept as they are, or runs of whitespace elsewhere
+_QUOTED_OR_WHITESPACE = re.compile(r"""('(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*"|`[^`]*`)|\s+""")
+
+KIND_ROWS = 'rows'
+KIND_POLARS = 'polars'
+KIND_PANDAS = 'pandas'
+
+
+def normalize_query(query: str) -> str:
+    """
+    Collapse whitespace outside quotes and drop the trailing semicolon, so reformatted queries share a cache entry.
+
+    Whitespace in string literals is kept, 'A  1' and 'A 1' being different values.
+    """
+    return _QUOTED_OR_WHITESPACE.sub(lambda match: match.group(1) or ' ', query).strip().rstrip(';').rstrip()
+
+
+def cache_key(query: str, params=None, namespace: str = '') -> str:
+    return hashlib.sha256(f"{namespace}\0{normalize_query(query)}\0{params!r}".encode()).hexdigest()
+
+
+def data_source(host, port, database, user, via=None) -> str:
+    """Cache namespace of a database, so the same query against another one never shares its results."""
+    source = f"mysql://{user}@{host}:{port}/{database}"
+    return f"{source} via {via}" if via else source
+
+
+def _kind(value) -> str:
+    module = type(value).__module__.split('.')[0]
+    if module == 'polars':
+        return KIND_POLARS
+    if module == 'pandas':
+        return KIND_PANDAS
+    return KIND_ROWS
+
+
+class QueryCache:
+    """
+    LRU cache of query results with a time to live, spilling large results to disk.
+
+    Entries are keyed by a namespace naming the data source, see
+    data_source(), the normalized query and its parameters. Results of
+    spill_rows rows or more are written to zstd compressed Parquet files in
+    spill_dir and only their key is kept in memory. Spilled results outlive
+    the process, so a report run again within ttl seconds reads them back
+    instead of querying the database; set spill_rows to 0 to keep every
+    result on disk.
+
+    Results are lists of row tuples, polars or pandas DataFrames, and are
+    read back from disk with the same types, DECIMAL values as Decimal.
+    """
+
+    def __init__(
+            self,
+            max_entries: int = 128,
+            ttl: float = 3600,
+            spill_dir: Optional[str] = None,
+            spill_rows: int = SPILL_ROWS
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.spill_rows = spill_rows
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self.spills = 0
+        # key -> (expiry time, kind, result or None when spilled)
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def _path(self, key: str, kind: str) -> str:
+        return os.path.join(self.spill_dir, f"{key}.{kind}.parquet")
+
+    def _spill(self, key: str, kind: str, value) -> bool:
+        path = self._path(key, kind)
+        tmp_path = f"{path}.tmp"
+        try:
+            if kind == KIND_PANDAS:
+                value.to_parquet(tmp_path, compression='zstd', index=False)
+            else:
+                import polars as pl
+                if kind == KIND_ROWS:
+                    value = pl.DataFrame(value, orient='row', infer_schema_length=None)
+                value.write_parquet(tmp_path, compression='zstd')
+        except Exception as e:
+            # Columns of mixed types cannot be written, those results stay in memory
+            logger.warning(f"Unable to spill cached result {key} to disk: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        os.replace(tmp_path, path)
+        self.spills += 1
+        return True
+
+    def _load(self, key: str, kind: str):
+        path = self._path(key, kind)
+        if kind == KIND_PANDAS:
+            import pandas as pd
+            return pd.read_parquet(path)
+        # pyarrow reads DECIMAL columns back as decimals, polars as floats unless built from Decimal objects
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+        if kind == KIND_ROWS:
+            return list(zip(*(column.to_pylist() for column in table.columns)))
+        import polars as pl
+        decimals = [
+            pl.Series(field.name, table[field.name].to_pylist(),
+                      dtype=pl.Decimal(field.type.precision, field.type.scale))
+            for field in table.schema if pa.types.is_decimal(field.type)
+        ]
+        frame = pl.from_arrow(table)
+        return frame.with_columns(decimals) if decimals else frame
+
+    def _spilled(self, key: str):
+        """Return the kind and expiry time of an unexpired spill file of a key."""
+        if self.spill_dir is None:
+            return None
+        for kind in (KIND_ROWS, KIND_POLARS, KIND_PANDAS):
+            path = self._path(key, kind)
+            if os.path.exists(path):
+                expires = os.path.getmtime(path) + self.ttl
+                if expires > time.time():
+                    return kind, expires
+                os.remove(path)
+        return None
+
+    def get(self, query: str, params=None, default=None, namespace: str = ''):
+        """Return the cached result of a query, or default."""
+        key = cache_key(query, params, namespace)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.time():
+                self._discard(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                _, kind, value = entry
+                if value is not None:
+                    self.hits += 1
+                    return value
+            else:
+                spilled = self._spilled(key)
+                if spilled is None:
+                    self.misses += 1
+                    return default
+                kind, expires = spilled
+                self._remember(key, (expires, kind, None))
+            try:
+                value = self._load(key, kind)
+            except Exception as e:
+                # A spill file removed meanwhile, unreadable, or written without a reader installed, e.g. pyarrow
+                if not isinstance(e, FileNotFoundError):
+                    logger.warning(f"Unable to read cached result {key} from disk, dropping it: {e}")
+                self._entries.pop(key, None)
+                if os.path.exists(self._path(key, kind)):
+                    os.remove(self._path(key, kind))
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.disk_hits += 1
+            return value
+
+    def put(self, query: str, params, value, namespace: str = ''):
+        """Cache the result of a query."""
+        key = cache_key(query, params, namespace)
+        kind = _kind(value)
+        spilled = False
+        if self.spill_dir is not None and len(value) and len(value) >= self.spill_rows:
+            spilled = self._spill(key, kind, value)
+        with self._lock:
+            self._remember(key, (time.time() + self.ttl, kind, None if spilled else value))
+
+    def get_or_load(self, query: str, params, loader: Callable[[], object], namespace: str = ''):
+        """Return the cached result of a query, calling loader and caching its result on a miss."""
+        missing = object()
+        value = self.get(query, params, missing, namespace)
+        if value is missing:
+            value = loader()
+            self.put(query, params, value, namespace)
+        return value
+
+    def _remember(self, key: str, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            # Spill files of evicted entries are kept, they expire with their ttl
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _discard(self, key: str):
+        _, kind, _ = self._entries.pop(key)
+        if self.spill_dir is not None and os.path.exists(self._path(key, kind)):
+            os.remove(self._path(key, kind))
+
+    def invalidate(self, query: str, params=None, namespace: str = ''):
+        """Drop the cached result of a query, in memory and on disk."""
+        key = cache_key(query, params, namespace)
+        with self._lock:
+            self._entries.pop(key, None)
+            if self.spill_dir is not None:
+                for kind in (KIND_ROWS, KIND_POLARS, KIND_PANDAS):
+                    if os.path.exists(self._path(key, kind)):
+                        os.remove(self._path(key, kind))
+
+    def clear(self):
+        """Drop all cached results, including every spill file."""
+        with self._lock:
+            self._entries.clear()
+            if self.spill_dir is not None:
+                for name in os.listdir(self.spill_dir):
+                    if name.endswith('.parquet'):
+                        os.remove(os.path.join(self.spill_dir, name))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'evictions': self.evictions,
+                'spills': self.spills,
+            }
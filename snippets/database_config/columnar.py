@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+ENGINE_POLARS = 'polars'
+ENGINE_PANDAS = 'pandas'
+
+# MySQL protocol column type codes, shared by mysql.connector and pymysql cursor descriptions
+INTEGER_TYPES = {1, 2, 3, 8, 9, 13}  # TINY, SHORT, LONG, LONGLONG, INT24, YEAR
+FLOAT_TYPES = {0, 4, 5, 246}  # DECIMAL, FLOAT, DOUBLE, NEWDECIMAL
+DATETIME_TYPES = {7, 12}  # TIMESTAMP, DATETIME
+DATE_TYPES = {10, 14}  # DATE, NEWDATE
+TEXT_TYPES = {15, 245, 247, 248, 253, 254}  # VARCHAR, JSON, ENUM, SET, VAR_STRING, STRING
+
+
+class ColumnarBuilder:
+    """
+    Builds a DataFrame from result batches, one typed column chunk per batch.
+
+    Every batch of row tuples is transposed and converted to native integer,
+    float, datetime and date arrays as soon as it arrives, so only one batch of
+    boxed Python values exists at a time. DECIMAL columns become floats.
+    """
+
+    def __init__(self, description, engine: str = ENGINE_POLARS):
+        if engine not in (ENGINE_POLARS, ENGINE_PANDAS):
+            raise ValueError(f"Unknown DataFrame engine {engine!r}")
+        self.engine = engine
+        self.columns = [column[0] for column in description]
+        self.type_codes = [column[1] for column in description]
+        self._chunks = [[] for _ in self.columns]
+        self.rows = 0
+
+    def append(self, rows):
+        """Convert a batch of row tuples into column chunks."""
+        if not rows:
+            return
+        import numpy as np
+        # One 2-D object array transposes the batch far cheaper than zip(*rows)
+        cells = np.empty((len(rows), len(self.columns)), dtype=object)
+        cells[:] = rows
+        convert = self._polars_chunk if self.engine == ENGINE_POLARS else self._pandas_chunk
+        for i in range(len(self.columns)):
+            self._chunks[i].append(convert(self.columns[i], self.type_codes[i], cells[:, i]))
+        self.rows += len(rows)
+
+    @staticmethod
+    def _datetimes(values):
+        """Datetime or date objects to datetime64[us], None to NaT; pandas parses them in C."""
+        import pandas as pd
+        return pd.DatetimeIndex(values).as_unit('us').to_numpy()
+
+    @classmethod
+    def _polars_chunk(cls, name, type_code, values):
+        import polars as pl
+        if type_code in INTEGER_TYPES:
+            return pl.Series(name, values.tolist(), dtype=pl.Int64)
+        if type_code in FLOAT_TYPES:
+            return pl.Series(name, values.tolist(), dtype=pl.Float64, strict=False)
+        if type_code in DATETIME_TYPES:
+            return pl.Series(name, cls._datetimes(values))
+        if type_code in DATE_TYPES:
+            return pl.Series(name, cls._datetimes(values)).cast(pl.Date)
+        series = pl.Series(name, values.tolist(), strict=False)
+        if series.dtype == pl.Null and type_code in TEXT_TYPES:
+            # A batch of NULLs only, e.g. the first ones of a sparse column
+            series = series.cast(pl.Utf8)
+        return series
+
+    @staticmethod
+    def _concat_polars(chunks):
+        """Concatenate the chunks of a column, all-NULL chunks cast to the type of the others."""
+        import polars as pl
+        if len(chunks) == 1:
+            return chunks[0]
+        dtype = next((chunk.dtype for chunk in chunks if chunk.dtype != pl.Null), pl.Null)
+        return pl.concat([chunk.cast(dtype) if chunk.dtype == pl.Null else chunk for chunk in chunks], rechunk=True)
+
+    @classmethod
+    def _pandas_chunk(cls, name, type_code, values):
+        import numpy as np
+        import pandas as pd
+        if type_code in INTEGER_TYPES:
+            if np.equal(values, None).any():
+                return pd.array(values, dtype='Int64')
+            return values.astype(np.int64)
+        if type_code in FLOAT_TYPES:
+            return np.where(np.equal(values, None), np.nan, values).astype(np.float64)
+        if type_code in DATETIME_TYPES:
+            return cls._datetimes(values)
+        if type_code in DATE_TYPES:
+            return cls._datetimes(values).astype('datetime64[s]')
+        return values
+
+    def frame(self):
+        """Return the DataFrame of all appended batches."""
+        import numpy as np
+        if self.engine == ENGINE_POLARS:
+            import polars as pl
+            if not self.rows:
+                return pl.DataFrame([
+                    self._polars_chunk(name, type_code, np.empty(0, dtype=object))
+                    for name, type_code in zip(self.columns, self.type_codes)
+                ])
+            return pl.DataFrame([self._concat_polars(chunks) for chunks in self._chunks])
+        import pandas as pd
+        if not self.rows:
+            return pd.DataFrame(columns=self.columns)
+        return pd.DataFrame({
+            name: pd.concat([pd.Series(chunk, copy=False) for chunk in chunks], ignore_index=True)
+            for name, chunks in zip(self.columns, self._chunks)
+        })
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import datetime
+import logging
+import queue
+import threading
+from concurrent.futures import Future, as_completed
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from snippets.database_config.columnar import ColumnarBuilder
+
+logger = logging.getLogger(__name__)
+
+# No snapshot, every task reads the latest committed data
+SNAPSHOT_NONE = 'none'
+# Every task runs in its own consistent snapshot transaction
+SNAPSHOT_PER_TASK = 'task'
+# All tasks of a submit() read from the same point in time
+SNAPSHOT_SHARED = 'shared'
+
+# Seconds workers wait for each other while starting a shared snapshot
+SNAPSHOT_BARRIER_TIMEOUT = 60
+# Rows fetched per round trip when building frames
+FETCH_BATCH_SIZE = 10000
+# MySQL error raised when max_execution_time is exceeded
+ER_QUERY_TIMEOUT = 3024
+
+
+def _error_code(error: Exception) -> Optional[int]:
+    """Error number of a mysql.connector or pymysql error."""
+    code = getattr(error, 'errno', None)
+    if code is None and error.args and isinstance(error.args[0], int):
+        code = error.args[0]
+    return code
+
+
+def start_snapshot(cursor):
+    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+    cursor.execute('START TRANSACTION WITH CONSISTENT SNAPSHOT')
+
+
+def daily_tasks(query: str, first_day: datetime.date, last_day: datetime.date) -> List[Tuple[str, tuple]]:
+    """One task per day from first_day to last_day, the query taking the day start and end as parameters."""
+    return [
+        (query, (first_day + datetime.timedelta(days=i), first_day + datetime.timedelta(days=i + 1)))
+        for i in range((last_day - first_day).days + 1)
+    ]
+
+
+class QueryExecutor:
+    """
+    Runs a list of (query, params) tasks concurrently on pooled connections.
+
+    Works with MySQLConnector and DbFacade. Each worker checks out one
+    connection and runs tasks from a shared queue on it until none are left,
+    so at most `workers` connections are in use; the pool must be at least
+    that large, plus one for the lock connection of a locked shared snapshot.
+
+    With SNAPSHOT_SHARED the workers start their snapshot transactions
+    together before running any task. With lock_tables the snapshots are
+    started while FLUSH TABLES WITH READ LOCK is held, which needs the RELOAD
+    privilege and guarantees that all of them see the same data; without it
+    they are only started back to back.
+
+    A timeout sets max_execution_time for the task's statement, so MySQL
+    aborts SELECTs running longer and the task fails with TimeoutError.
+    """
+
+    def __init__(
+            self,
+            source,
+            workers: int = 4,
+            timeout: Optional[float] = None,
+            snapshot: str = SNAPSHOT_NONE,
+            lock_tables: bool = False,
+            engine: Optional[str] = None
+    ):
+        if snapshot not in (SNAPSHOT_NONE, SNAPSHOT_PER_TASK, SNAPSHOT_SHARED):
+            raise ValueError(f"Unknown snapshot mode {snapshot!r}")
+        self.source = source
+        self.workers = workers
+        self.timeout = timeout
+        self.snapshot = snapshot
+        self.lock_tables = lock_tables
+        self.engine = engine
+
+    @staticmethod
+    def _tasks(tasks) -> List[Tuple[str, Optional[tuple]]]:
+        return [(task, None) if isinstance(task, str) else tuple(task) for task in tasks]
+
+    def _fetch(self, cursor):
+        if self.engine is None:
+            return cursor.fetchall()
+        builder = ColumnarBuilder(cursor.description, self.engine)
+        rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+        while rows:
+            builder.append(rows)
+            rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+        return builder.frame()
+
+    def _run_task(self, connection, query, params):
+        cursor = connection.cursor()
+        try:
+            if self.snapshot == SNAPSHOT_PER_TASK:
+                start_snapshot(cursor)
+            # Unbuffered cursors get the timeout while fetching, after the first rows arrived
+            try:
+                cursor.execute(query, params)
+                return self._fetch(cursor)
+            except Exception as e:
+                if _error_code(e) == ER_QUERY_TIMEOUT:
+                    raise TimeoutError(f"Query exceeded its {self.timeout}s timeout: {query}") from e
+                raise
+        finally:
+            cursor.close()
+            if self.snapshot != SNAPSHOT_SHARED:
+                # Ends the read transaction, the next task sees fresh data
+                connection.rollback()
+
+    def _worker(self, pending: queue.Queue, barrier: Optional[threading.Barrier], errors: list):
+        try:
+            with self.source._get_connection() as connection:
+                cursor = connection.cursor()
+                try:
+                    if self.timeout is not None:
+                        cursor.execute('SET SESSION max_execution_time = %s', (int(self.timeout * 1000),))
+                    if barrier is not None:
+                        barrier.wait()
+                        start_snapshot(cursor)
+                        barrier.wait()
+                    self._drain(connection, pending)
+                finally:
+                    if self.snapshot == SNAPSHOT_SHARED:
+                        connection.rollback()
+                    if self.timeout is not None:
+                        cursor.execute('SET SESSION max_execution_time = DEFAULT')
+                    cursor.close()
+        except Exception as e:
+            logger.error(f"Query worker failed: {e}")
+            errors.append(e)
+            if barrier is not None:
+                # No worker can start its snapshot without this one, all tasks fail
+                barrier.abort()
+                self._fail_pending(pending, e)
+
+    def _drain(self, connection, pending: queue.Queue):
+        """Run queued tasks on the connection until none are left."""
+        while True:
+            try:
+                future, query, params = pending.get_nowait()
+            except queue.Empty:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._run_task(connection, query, params))
+            except Exception as e:
+                logger.error(f"Query failed: {e}")
+                future.set_exception(e)
+
+    @staticmethod
+    def _fail_pending(pending: queue.Queue, error: Exception):
+        while True:
+            try:
+                future, _, _ = pending.get_nowait()
+            except queue.Empty:
+                return
+            if future.set_running_or_notify_cancel():
+                future.set_exception(error)
+
+    def _lock_and_wait(self, barrier: threading.Barrier):
+        """Hold FLUSH TABLES WITH READ LOCK while the workers start their snapshots."""
+        try:
+            with self.source._get_connection() as connection:
+                cursor = connection.cursor()
+                try:
+                    cursor.execute('FLUSH TABLES WITH READ LOCK')
+                    try:
+                        barrier.wait()
+                        barrier.wait()
+                    finally:
+                        cursor.execute('UNLOCK TABLES')
+                finally:
+                    cursor.close()
+        except Exception as e:
+            barrier.abort()
+            logger.error(f"Unable to lock tables for a shared snapshot: {e}")
+
+    def submit(self, tasks: Iterable) -> List[Future]:
+        """
+        Start running the tasks and return one future per task, in task order.
+
+        Tasks are (query, params) tuples or plain queries.
+        """
+        tasks = self._tasks(tasks)
+        futures = [Future() for _ in tasks]
+        pending = queue.Queue()
+        for future, (query, params) in zip(futures, tasks):
+            pending.put((future, query, params))
+        workers = max(min(self.workers, len(tasks)), 1)
+
+        barrier = None
+        threads = []
+        errors = []
+        if self.snapshot == SNAPSHOT_SHARED:
+            barrier = threading.Barrier(workers + 1 if self.lock_tables else workers,
+                                        timeout=SNAPSHOT_BARRIER_TIMEOUT)
+            if self.lock_tables:
+                threads.append(threading.Thread(target=self._lock_and_wait, args=(barrier,),
+                                                name='query-snapshot-lock', daemon=True))
+        for i in range(workers):
+            threads.append(threading.Thread(target=self._worker, args=(pending, barrier, errors),
+                                            name=f"query-worker-{i}", daemon=True))
+        for thread in threads:
+            thread.start()
+
+        def reap():
+            for thread in threads:
+                thread.join()
+            # Tasks left behind once every worker failed, e.g. could not connect; the others run the rest
+            error = RuntimeError('No query worker left to run the task')
+            error.__cause__ = errors[-1] if errors else None
+            self._fail_pending(pending, error)
+
+        threading.Thread(target=reap, name='query-reaper', daemon=True).start()
+        return futures
+
+    def map(self, tasks: Iterable) -> Iterator:
+        """Run the tasks and yield their results in task order; a failed task raises its error."""
+        for future in self.submit(tasks):
+            yield future.result()
+
+    def as_completed(self, tasks: Iterable) -> Iterator[Tuple[int, object]]:
+        """Run the tasks and yield (task index, result) pairs as they complete; a failed task raises its error."""
+        futures = {future: i for i, future in enumerate(self.submit(tasks))}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+    def run(self, tasks: Iterable) -> list:
+        """Run the tasks and return their results in task order."""
+        return list(self.map(tasks))
@@ -2,17 +2,37 @@
 # -*- coding: utf-8 -*-
 
 import logging
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
 
 import pandas as pd
 import pymysql
+import pymysql.cursors
 from sshtunnel import SSHTunnelForwarder
 
+from snippets.database_config.cache import data_source
+from snippets.database_config.columnar import ColumnarBuilder, ENGINE_PANDAS, ENGINE_POLARS
 from snippets.utils.decorators import measure_and_log_elapsed_time
 
+logger = logging.getLogger(__name__)
+
+# Rows fetched per round trip by stream_query()
+STREAM_BATCH_SIZE = 10000
+# MySQL connections kept open through the tunnel
+DEFAULT_POOL_SIZE = 4
+
 
 class DbFacade:
+    """
+    Runs queries against a MySQL server reached through an SSH tunnel.
+
+    The tunnel is opened on first use and kept open, restarted whenever it
+    goes down, and up to pool_size MySQL connections through it are kept for
+    reuse. Use it as a context manager, or call close(), to shut both down.
+    """
+
     def __init__(self, ssh_host, ssh_port, ssh_username, ssh_private_key, mysql_host, mysql_port, mysql_user,
-                 mysql_password, mysql_db):
+                 mysql_password, mysql_db, pool_size=DEFAULT_POOL_SIZE):
         self.ssh_host = ssh_host
         self.ssh_port = ssh_port
         self.ssh_username = ssh_username
@@ -22,40 +42,206 @@ class DbFacade:
         self.mysql_user = mysql_user
         self.mysql_password = mysql_password
         self.mysql_db = mysql_db
+        self.pool_size = pool_size
+        self.cache = None
+        self._tunnel = None
+        # Connections opened through an older tunnel are dropped instead of reused
+        self._tunnel_generation = 0
+        self._idle = []
+        self._lock = Lock()
+        self._slots = BoundedSemaphore(pool_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _open_tunnel(self):
+        return SSHTunnelForwarder(
+            (self.ssh_host, self.ssh_port),
+            ssh_username=self.ssh_username,
+            ssh_pkey=self.ssh_private_key,
+            remote_bind_address=(self.mysql_host, self.mysql_port)
+        )
+
+    def _ensure_tunnel(self):
+        """Return the running tunnel, (re)starting it when needed; called with the lock held."""
+        if self._tunnel is not None and self._tunnel.is_active:
+            return self._tunnel
+        if self._tunnel is not None:
+            logger.warning(f"SSH tunnel to {self.ssh_host} is down, reconnecting")
+            self._close_idle()
+            self._tunnel.stop()
+        self._tunnel = self._open_tunnel()
+        self._tunnel.start()
+        self._tunnel_generation += 1
+        logger.info(f"SSH tunnel to {self.ssh_host} listening on port {self._tunnel.local_bind_port}")
+        return self._tunnel
+
+    def _connect(self, tunnel):
+        return pymysql.connect(
+            host=tunnel.local_bind_host,
+            port=tunnel.local_bind_port,
+            user=self.mysql_user,
+            password=self.mysql_password,
+            database=self.mysql_db
+        )
+
+    def _close_idle(self):
+        for _, connection in self._idle:
+            if connection.open:
+                connection.close()
+        self._idle.clear()
+
+    @contextmanager
+    def _get_connection(self):
+        """Check out a pooled connection, health checked with a ping, and return it to the pool afterwards."""
+        self._slots.acquire()
+        try:
+            with self._lock:
+                tunnel = self._ensure_tunnel()
+                generation = self._tunnel_generation
+                connection = None
+                while self._idle and connection is None:
+                    idle_generation, idle_connection = self._idle.pop()
+                    if idle_generation == generation:
+                        connection = idle_connection
+                    elif idle_connection.open:
+                        idle_connection.close()
+            try:
+                if connection is None:
+                    connection = self._connect(tunnel)
+                else:
+                    connection.ping(reconnect=True)
+                yield connection
+            except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+                if connection is not None and connection.open:
+                    connection.close()
+                raise
+            finally:
+                if connection is not None:
+                    self._release(generation, connection)
+        finally:
+            self._slots.release()
+
+    def _release(self, generation, connection):
+        with self._lock:
+            if connection.open and generation == self._tunnel_generation and self._tunnel is not None:
+                self._idle.append((generation, connection))
+                return
+        if connection.open:
+            connection.close()
 
-    def _run_with_connection_and_cursor(self, query_func):
-        """Establishes an SSH tunnel and runs a query function using a MySQL connection and cursor."""
-        with SSHTunnelForwarder(
-                (self.ssh_host, self.ssh_port),
-                ssh_username=self.ssh_username,
-                ssh_pkey=self.ssh_private_key,
-                remote_bind_address=(self.mysql_host, self.mysql_port)
-        ) as tunnel:
-            connection = pymysql.connect(
-                host=self.mysql_host,
-                port=tunnel.local_bind_port,
-                user=self.mysql_user,
-                password=self.mysql_password,
-                database=self.mysql_db
-            )
-            with connection.cursor() as cursor:
-                cursor.execute('SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
-                cursor.execute('START TRANSACTION WITH CONSISTENT SNAPSHOT')
-                return query_func(connection, cursor)
+    @staticmethod
+    def _start_snapshot(cursor):
+        # Scoped to the next transaction only, pooled connections are reused for writes too
+        cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+        cursor.execute('START TRANSACTION WITH CONSISTENT SNAPSHOT')
+
+    @contextmanager
+    def _cursor(self, cursor_class=None, snapshot=True):
+        """Yield a cursor on a pooled connection, inside a consistent snapshot read transaction by default."""
+        with self._get_connection() as connection:
+            try:
+                with connection.cursor(cursor_class) as cursor:
+                    if snapshot:
+                        self._start_snapshot(cursor)
+                    yield cursor
+            finally:
+                if connection.open:
+                    connection.rollback()
+
+    def _run_with_connection_and_cursor(self, query_func, snapshot=True):
+        """Runs a query function using a pooled MySQL connection and cursor."""
+        with self._cursor(snapshot=snapshot) as cursor:
+            return query_func(cursor.connection, cursor)
+
+    def close(self):
+        """Close the pooled connections and the SSH tunnel."""
+        with self._lock:
+            self._close_idle()
+            if self._tunnel is not None:
+                self._tunnel.stop()
+                self._tunnel = None
 
     @measure_and_log_elapsed_time
-    def execute_query(self, query):
+    def execute_query(self, query, snapshot=True):
         """Executes a query and returns the result."""
 
         def run_query(connection, cursor):
             cursor.execute(query)
             return cursor.fetchall()
 
-        return self._run_with_connection_and_cursor(run_query)
+        return self._run_with_connection_and_cursor(run_query, snapshot)
+
+    def _iter_batches(self, query, params, batch_size, snapshot=True):
+        """
+        Yield the cursor description with each batch of rows of a query run on a server-side cursor.
+
+        The first batch is yielded even when it is empty, so the description of
+        an empty result is known too.
+        """
+        with self._cursor(pymysql.cursors.SSCursor, snapshot) as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchmany(batch_size)
+            yield cursor.description, rows
+            while rows:
+                rows = cursor.fetchmany(batch_size)
+                if rows:
+                    yield cursor.description, rows
+
+    def stream_query(self, query, params=None, batch_size=STREAM_BATCH_SIZE, frames=False, snapshot=True):
+        """
+        Execute a query on a server-side cursor and yield its rows in batches.
+
+        Only one batch is held in memory at a time; the pooled connection is
+        returned when the generator is exhausted or closed.
+
+        Args:
+            query: SQL query.
+            params: Optional query parameters.
+            batch_size: Rows per batch.
+            frames: Yield pandas DataFrames instead of tuples of rows.
+            snapshot: Run the query in a consistent snapshot read transaction.
+        """
+        for description, rows in self._iter_batches(query, params, batch_size, snapshot):
+            if not rows:
+                continue
+            if frames:
+                builder = ColumnarBuilder(description, ENGINE_PANDAS)
+                builder.append(rows)
+                yield builder.frame()
+            else:
+                yield rows
+
+    @measure_and_log_elapsed_time
+    def query_frame(self, query, params=None, engine=ENGINE_POLARS, batch_size=STREAM_BATCH_SIZE, snapshot=True):
+        """
+        Execute a query and return its result as a polars or pandas DataFrame.
+
+        Rows are streamed and converted batch by batch into typed columns,
+        integers, floats, datetimes and dates kept native, without ever
+        holding the whole result as Python tuples.
+        """
+        builder = None
+        for description, rows in self._iter_batches(query, params, batch_size, snapshot):
+            if builder is None:
+                builder = ColumnarBuilder(description, engine)
+            builder.append(rows)
+        return builder.frame()
 
     def fetch_data(self, query):
         """Returns a list of tables in the database."""
         return self.execute_query(query)
 
+    def use_cache(self, cache):
+        """Serve fetch_data_from_database_and_publish() from a QueryCache, None to stop caching."""
+        self.cache = cache
+
     def fetch_data_from_database_and_publish(self, query):
+        if self.cache is not None:
+            namespace = data_source(self.mysql_host, self.mysql_port, self.mysql_db, self.mysql_user,
+                                    via=f"ssh://{self.ssh_username}@{self.ssh_host}:{self.ssh_port}")
+            return self.cache.get_or_load(query, None, lambda: self.execute_query(query), namespace)
         return self.execute_query(query)
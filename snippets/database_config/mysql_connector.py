@@ -2,16 +2,90 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import tempfile
+import time
 from contextlib import contextmanager
 import mysql.connector
 from mysql.connector import pooling
-from threading import Lock
+from threading import BoundedSemaphore, Lock, local
 
 from snippets.database_config import MySQLConfig
-from snippets.utils.decorators import retry_with_backoff, set_session_params, measure_and_log_elapsed_time
+from snippets.database_config.cache import data_source
+from snippets.database_config.columnar import ColumnarBuilder, ENGINE_PANDAS, ENGINE_POLARS
+from snippets.utils.decorators import get_circuit_breaker, retry_with_backoff, set_session_params, \
+    measure_and_log_elapsed_time
 
 logger = logging.getLogger(__name__)
 
+# Seconds a caller waits for a free pooled connection
+POOL_CHECKOUT_TIMEOUT = 30
+# Attempts to reconnect a broken pooled connection on checkout
+CHECKOUT_ATTEMPTS = 3
+
+# Rows fetched per round trip by stream_query()
+STREAM_BATCH_SIZE = 10000
+
+# Ways of sending rows in bulk_upsert()
+BULK_INSERT = object()
+BULK_LOAD_DATA = object()
+# Server error of a row outside the partitions of its table
+ER_NO_PARTITION_FOR_VALUE = 1526
+
+_INFILE_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\0': '\\0'})
+
+
+def _infile_value(value) -> str:
+    """Format a value for LOAD DATA INFILE with the default field and line terminators."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode('utf-8', errors='backslashreplace')
+    return str(value).translate(_INFILE_ESCAPES)
+
+
+class PoolMetrics:
+    """Connection pool checkout counters and wait times."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.checkouts = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.failed_checkouts = 0
+
+    def record_checkout(self, wait: float):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            if wait >= 0.001:
+                self.waited += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def record_checkin(self):
+        with self._lock:
+            self.in_use -= 1
+
+    def record_failed_checkout(self):
+        with self._lock:
+            self.failed_checkouts += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'waited': self.waited,
+                'avg_wait': self.total_wait / self.checkouts if self.checkouts else 0.0,
+                'max_wait': self.max_wait,
+                'in_use': self.in_use,
+                'peak_in_use': self.peak_in_use,
+                'failed_checkouts': self.failed_checkouts,
+            }
+
 
 class MySQLConnector:
     _instance = None
@@ -33,49 +107,370 @@ class MySQLConnector:
             port=self.config['port'],
             user=self.config['user'],
             password=self.config['password'],
-            database=self.config['database']
+            database=self.config['database'],
+            allow_local_infile=self.config['allow_local_infile']
         )
-        self.connection = None
+        self.metrics = PoolMetrics()
+        self._slots = BoundedSemaphore(self.config['pool_size'])
+        self._local = local()
+        self._breaker = get_circuit_breaker(f"mysql:{self.config['host']}:{self.config['port']}")
+        self.cache = None
 
-    @retry_with_backoff()
+    @retry_with_backoff(exceptions=(mysql.connector.Error,))
     def connect(self):
+        """Check that a pooled connection can be established."""
         try:
-            self.connection = self.connection_pool.get_connection()
-            logger.info("MySQL connection established")
+            with self._get_connection():
+                logger.info("MySQL connection established")
         except mysql.connector.Error as err:
             logger.error(f"Error: {err}")
-            self.connection = None
+            raise
+
+    def _checkout(self):
+        """
+        Take a healthy connection from the pool.
+
+        The pool pings every connection it hands out and reconnects it when the
+        ping fails; a failed reconnect is retried CHECKOUT_ATTEMPTS times.
+        """
+        for attempt in range(1, CHECKOUT_ATTEMPTS + 1):
+            try:
+                return self.connection_pool.get_connection()
+            except (mysql.connector.InterfaceError, mysql.connector.OperationalError) as err:
+                self.metrics.record_failed_checkout()
+                if attempt == CHECKOUT_ATTEMPTS:
+                    raise
+                logger.warning(f"Pooled MySQL connection is broken ({err}), reconnecting "
+                               f"({attempt}/{CHECKOUT_ATTEMPTS})")
+                time.sleep(attempt)
 
     @contextmanager
-    def _get_cursor(self):
-        """Context manager to get a cursor from the MySQL connection."""
-        if not self.connection:
-            self.connect()
-        cursor = self.connection.cursor()
+    def _get_connection(self):
+        """
+        Check out a pooled connection and return it to the pool afterwards.
+
+        Callers block while all pool_size connections are checked out, at most
+        POOL_CHECKOUT_TIMEOUT seconds. Checkouts go through the circuit breaker
+        of the server: failing ones are counted, and while it is open callers
+        get CircuitOpenError at once instead of piling onto the dead server.
+        """
+        self._breaker.before_call()
+        start_time = time.monotonic()
+        if not self._slots.acquire(timeout=POOL_CHECKOUT_TIMEOUT):
+            # A busy pool says nothing about the server
+            self._breaker.release()
+            raise pooling.PoolError(f"No connection of pool {self.config['pool_name']} "
+                                    f"freed up within {POOL_CHECKOUT_TIMEOUT}s")
         try:
-            yield cursor
+            try:
+                connection = self._checkout()
+            except mysql.connector.Error:
+                self._breaker.record_failure()
+                raise
+            except BaseException:
+                self._breaker.release()
+                raise
+            self._breaker.record_success()
+            self.metrics.record_checkout(time.monotonic() - start_time)
+            try:
+                yield connection
+            finally:
+                connection.close()
+                self.metrics.record_checkin()
         finally:
-            cursor.close()
+            self._slots.release()
+
+    @contextmanager
+    def _get_cursor(self):
+        """
+        Context manager to get a cursor on a pooled connection, committed on success.
+
+        Nested calls in the same thread share the connection, so session
+        settings made by an outer call apply to the inner ones.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            cursor = connection.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+            return
+        with self._get_connection() as connection:
+            self._local.connection = connection
+            cursor = connection.cursor()
+            try:
+                yield cursor
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                cursor.close()
+                self._local.connection = None
+
+    @contextmanager
+    def transaction(self):
+        """Context manager yielding a cursor on its own pooled connection, committed on success."""
+        with self._get_connection() as connection:
+            cursor = connection.cursor()
+            try:
+                yield cursor
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                cursor.close()
 
     # @set_session_params
     @measure_and_log_elapsed_time
-    def execute_query(self, query):
+    def execute_query(self, query, params=None):
         """Executes a query and returns the result."""
         with self._get_cursor() as cursor:
-            cursor.execute(query)
+            cursor.execute(query, params)
             return cursor.fetchall()
 
+    def _iter_batches(self, query, params, batch_size):
+        """
+        Yield the cursor description with each batch of rows of a query run on an unbuffered cursor.
+
+        The first batch is yielded even when it is empty, so the description of
+        an empty result is known too.
+        """
+        with self._get_connection() as connection:
+            cursor = connection.cursor(buffered=False)
+            try:
+                cursor.execute(query, params)
+                rows = cursor.fetchmany(batch_size)
+                yield cursor.description, rows
+                while rows:
+                    rows = cursor.fetchmany(batch_size)
+                    if rows:
+                        yield cursor.description, rows
+            finally:
+                if connection.unread_result:
+                    connection.consume_results()
+                cursor.close()
+
+    def stream_query(self, query, params=None, batch_size=STREAM_BATCH_SIZE, frames=False):
+        """
+        Execute a query on an unbuffered cursor and yield its rows in batches.
+
+        Only one batch is held in memory at a time. The pooled connection is
+        checked out until the generator is exhausted or closed; rows left
+        unread by a closed generator are drained before the connection is
+        returned.
+
+        Args:
+            query: SQL query.
+            params: Optional query parameters.
+            batch_size: Rows per batch.
+            frames: Yield pandas DataFrames instead of lists of tuples.
+        """
+        for description, rows in self._iter_batches(query, params, batch_size):
+            if not rows:
+                continue
+            if frames:
+                builder = ColumnarBuilder(description, ENGINE_PANDAS)
+                builder.append(rows)
+                yield builder.frame()
+            else:
+                yield rows
+
+    @measure_and_log_elapsed_time
+    def query_frame(self, query, params=None, engine=ENGINE_POLARS, batch_size=STREAM_BATCH_SIZE):
+        """
+        Execute a query and return its result as a polars or pandas DataFrame.
+
+        Rows are streamed and converted batch by batch into typed columns,
+        integers, floats, datetimes and dates kept native, without ever
+        holding the whole result as Python tuples.
+        """
+        builder = None
+        for description, rows in self._iter_batches(query, params, batch_size):
+            if builder is None:
+                builder = ColumnarBuilder(description, engine)
+            builder.append(rows)
+        return builder.frame()
+
+    @measure_and_log_elapsed_time
+    def execute(self, query, params=None):
+        """Executes a data modifying statement in its own transaction and returns the affected row count."""
+        with self.transaction() as cursor:
+            cursor.execute(query, params)
+            return cursor.rowcount
+
+    def bulk_upsert(self, table_name, rows, columns=None, update_columns=None, value_exprs=None,
+                    batch_size=1000, commit_every=10000, method=BULK_INSERT, skip_errnos=()):
+        """
+        Insert rows, updating the ones whose key already exists, and return the number of rows upserted.
+
+        An error aborts the upsert; the transactions committed before it are
+        kept and their row count is logged.
+
+        Args:
+            table_name: Target table.
+            rows: A pandas or polars DataFrame, or an iterable of tuples in the order of columns.
+            columns: Column names, taken from the DataFrame when omitted.
+            update_columns: Columns updated on a duplicate key, defaults to all columns.
+            value_exprs: Optional SQL expressions per column wrapping the value, e.g. {'day_local': 'TO_DAYS(%s)'}.
+            batch_size: Rows per multi-row INSERT statement.
+            commit_every: Rows per transaction.
+            method: BULK_INSERT for multi-row INSERT statements, or BULK_LOAD_DATA for LOAD DATA LOCAL
+                INFILE into a staging table merged into the target, which needs allow_local_infile.
+            skip_errnos: Server errors skipping the failing row instead of aborting, e.g.
+                (ER_NO_PARTITION_FOR_VALUE,); a batch failing with one is sent again row by row. BULK_INSERT only.
+        """
+        if skip_errnos and method is BULK_LOAD_DATA:
+            raise ValueError("bulk_upsert() skips failing rows only with BULK_INSERT.")
+        if hasattr(rows, 'itertuples'):
+            columns = list(columns or rows.columns)
+            frame = rows[columns].astype(object)
+            rows = frame.where(frame.notna(), None).itertuples(index=False, name=None)
+        elif hasattr(rows, 'iter_rows'):
+            columns = list(columns or rows.columns)
+            rows = rows.select(columns).iter_rows()
+        if not columns:
+            raise ValueError("bulk_upsert() needs the column names of tuple rows.")
+        update_columns = list(update_columns or columns)
+        value_exprs = value_exprs or {}
+        update = ', '.join(f"{column} = VALUES({column})" for column in update_columns)
+
+        start_time = time.monotonic()
+        with self.transaction() as cursor:
+            if method is BULK_LOAD_DATA:
+                total = self._upsert_load_data(cursor, table_name, rows, columns, value_exprs, update,
+                                               commit_every)
+            else:
+                total, skipped = self._upsert_insert(cursor, table_name, rows, columns, value_exprs, update,
+                                                     batch_size, commit_every, skip_errnos)
+                if skipped:
+                    logger.warning(f"Skipped {skipped} rows of {table_name} failing with errors {skip_errnos}")
+        elapsed = time.monotonic() - start_time
+        logger.info(f"Upserted {total} rows into {table_name} in {elapsed:.1f}s "
+                    f"({total / max(elapsed, 1e-6):.0f} rows/s)")
+        return total
+
+    @staticmethod
+    def _upsert_insert(cursor, table_name, rows, columns, value_exprs, update, batch_size, commit_every,
+                       skip_errnos=()):
+        """Upsert rows in multi-row INSERT statements and return the numbers of rows upserted and skipped."""
+        row_sql = '(' + ', '.join(value_exprs.get(column, '%s') for column in columns) + ')'
+        prefix = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES "
+        suffix = f" ON DUPLICATE KEY UPDATE {update}"
+        total = uncommitted = committed = skipped = 0
+        batch = []
+
+        def send():
+            nonlocal total, uncommitted, skipped
+            try:
+                cursor.execute(prefix + ', '.join([row_sql] * len(batch)) + suffix,
+                               [value for row in batch for value in row])
+                sent = len(batch)
+            except mysql.connector.Error as e:
+                if e.errno not in skip_errnos:
+                    raise
+                # The failed statement changed nothing, its rows are sent one by one to skip only the failing ones
+                sent = 0
+                for row in batch:
+                    try:
+                        cursor.execute(prefix + row_sql + suffix, row)
+                        sent += 1
+                    except mysql.connector.Error as row_error:
+                        if row_error.errno not in skip_errnos:
+                            raise
+                        skipped += 1
+                        logger.debug(f"Skipped row {row!r} of {table_name}: {row_error}")
+            total += sent
+            uncommitted += sent
+            batch.clear()
+
+        try:
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    send()
+                    if uncommitted >= commit_every:
+                        cursor.execute('COMMIT')
+                        committed, uncommitted = total, 0
+                        logger.debug(f"Committed {total} rows into {table_name}")
+            if batch:
+                send()
+        except Exception:
+            logger.error(f"Upsert into {table_name} failed, {committed} rows were committed before")
+            raise
+        return total, skipped
+
+    @staticmethod
+    def _upsert_load_data(cursor, table_name, rows, columns, value_exprs, update, commit_every):
+        staging = f"_stage_{table_name.replace('.', '_')}"
+        variables = [f"@v{i}" for i in range(len(columns))]
+        assignments = ', '.join(
+            f"{column} = {value_exprs.get(column, '%s').replace('%s', variable)}"
+            for column, variable in zip(columns, variables)
+        )
+        # Temporary tables cannot be partitioned, so the staging table copies only the column types
+        cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {staging}")
+        cursor.execute(f"CREATE TEMPORARY TABLE {staging} SELECT {', '.join(columns)} FROM {table_name} LIMIT 0")
+        total = 0
+        try:
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.tsv') as file_:
+                def merge():
+                    file_.flush()
+                    cursor.execute(
+                        f"LOAD DATA LOCAL INFILE %s INTO TABLE {staging} ({', '.join(variables)}) SET {assignments}",
+                        (file_.name,)
+                    )
+                    cursor.execute(f"INSERT INTO {table_name} ({', '.join(columns)}) "
+                                   f"SELECT {', '.join(columns)} FROM {staging} ON DUPLICATE KEY UPDATE {update}")
+                    cursor.execute('COMMIT')
+                    cursor.execute(f"DELETE FROM {staging}")
+                    file_.seek(0)
+                    file_.truncate()
+
+                pending = 0
+                try:
+                    for row in rows:
+                        file_.write('\t'.join(_infile_value(value) for value in row) + '\n')
+                        pending += 1
+                        if pending >= commit_every:
+                            merge()
+                            total += pending
+                            pending = 0
+                            logger.debug(f"Committed {total} rows into {table_name}")
+                    if pending:
+                        merge()
+                        total += pending
+                except Exception:
+                    logger.error(f"Upsert into {table_name} failed, {total} rows were committed before")
+                    raise
+        finally:
+            cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {staging}")
+        return total
+
+    def use_cache(self, cache):
+        """Serve fetch_data_from_database_and_publish() from a QueryCache, None to stop caching."""
+        self.cache = cache
+
     @retry_with_backoff()
-    def fetch_data_from_database_and_publish(self, query):
-        """Fetches data using a given query."""
-        return self.execute_query(query)
+    def fetch_data_from_database_and_publish(self, query, params=None):
+        """Fetches data using a given query, from the cache when one is in use."""
+        if self.cache is not None:
+            namespace = data_source(self.config['host'], self.config['port'], self.config['database'],
+                                    self.config['user'])
+            return self.cache.get_or_load(query, params, lambda: self.execute_query(query, params), namespace)
+        return self.execute_query(query, params)
 
     def close(self):
-        if self.connection:
-            self.connection.close()
-            logger.info("MySQL connection closed")
-        else:
-            logger.info("No active MySQL connection to close")
+        """Log the pool metrics; pooled connections are returned to the pool after every use."""
+        logger.info(f"MySQL pool {self.config['pool_name']}: {self.metrics.snapshot()}")
+        if self.cache is not None:
+            logger.info(f"Query cache: {self.cache.stats()}")
 
     def is_connected(self):
-        return self.connection.is_connected() if self.connection else False
\ No newline at end of file
+        try:
+            with self._get_connection() as connection:
+                return connection.is_connected()
+        except mysql.connector.Error:
+            return False
\ No newline at end of file
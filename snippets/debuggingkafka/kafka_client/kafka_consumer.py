@@ -12,15 +12,17 @@ logger = logging.getLogger(__name__)
 
 
 class KafkaConsumerClient:
-    def __init__(self, config: KafkaConfig):
+    def __init__(self, config: KafkaConfig, subscribe=True, decode=True):
+        """With decode False message values are left as bytes, for the caller to decode."""
         self.config = config.get_config()
         consumer_config = {
             'bootstrap_servers': self.config['bootstrap_servers'],
-            'value_deserializer': lambda x: json.loads(x.decode('utf-8')),
             'auto_offset_reset': 'earliest',  # Start from the earliest if no offset is found
             'enable_auto_commit': False,  # No automatic offset committing
             'group_id': None  # No group coordination
         }
+        if decode:
+            consumer_config['value_deserializer'] = lambda x: json.loads(x.decode('utf-8'))
         server_configs = {
             'security_protocol': self.config.get('security_protocol'),
             'sasl_mechanism': self.config.get('sasl_mechanism'),
@@ -38,7 +40,8 @@ class KafkaConsumerClient:
         }
         consumer_config.update({k: v for k, v in server_configs.items() if v is not None})
         self.consumer = KafkaConsumer(**consumer_config)
-        self.consumer.subscribe([self.config['topic']])
+        if subscribe:
+            self.consumer.subscribe([self.config['topic']])
 
     def close(self):
         if self.consumer:
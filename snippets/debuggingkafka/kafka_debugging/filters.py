@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import ast
+import json
+import operator
+
+# Names of expressions referring to the message instead of its value
+METADATA_NAMES = {'_key', '_headers', '_timestamp', '_partition', '_offset'}
+
+_COMPARISONS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda a, b: b is not None and a in b,
+    ast.NotIn: lambda a, b: b is None or a not in b,
+}
+
+# Returned by MessageFilter.apply() for messages which do not match
+NO_MATCH = object()
+
+
+def _text(value):
+    return value.decode('utf-8', 'replace') if isinstance(value, bytes) else value
+
+
+def _metadata(message):
+    return {
+        '_key': _text(message.key),
+        '_headers': {name: _text(value) for name, value in message.headers or ()},
+        '_timestamp': message.timestamp,
+        '_partition': message.partition,
+        '_offset': message.offset,
+    }
+
+
+def _path(node):
+    """The (root name, keys) of a field path like reading.msn or reading['msn'][0]."""
+    keys = []
+    while not isinstance(node, ast.Name):
+        if isinstance(node, ast.Attribute):
+            keys.append(node.attr)
+            node = node.value
+        elif isinstance(node, ast.Subscript):
+            index = node.slice
+            if not isinstance(index, ast.Constant):
+                raise ValueError(f"Only constant subscripts are supported: {ast.unparse(node)}")
+            keys.append(index.value)
+            node = node.value
+        else:
+            raise ValueError(f"Unsupported expression: {ast.unparse(node)}")
+    return node.id, list(reversed(keys))
+
+
+def field_path(text):
+    """The keys of a field path of the value given as text, e.g. 'reading.meter["msn"]'."""
+    root, keys = _path(ast.parse(text, mode='eval').body)
+    return [root] + keys
+
+
+def lookup(document, keys):
+    """The value at a field path of a decoded document, None when missing."""
+    for key in keys:
+        try:
+            document = document[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return document
+
+
+class _Compiler:
+    """Compiles an expression AST into a function of (metadata, value)."""
+
+    def __init__(self):
+        self.uses_value = False
+
+    def compile(self, node):
+        if isinstance(node, ast.Expression):
+            return self.compile(node.body)
+        if isinstance(node, ast.BoolOp):
+            parts = [self.compile(value) for value in node.values]
+            if isinstance(node.op, ast.And):
+                return lambda metadata, value: all(part(metadata, value) for part in parts)
+            return lambda metadata, value: any(part(metadata, value) for part in parts)
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            operand = self.compile(node.operand)
+            return lambda metadata, value: not operand(metadata, value)
+        if isinstance(node, ast.Compare):
+            return self._compare(node)
+        if isinstance(node, ast.Constant):
+            constant = node.value
+            return lambda metadata, value: constant
+        if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+            items = [self.compile(item) for item in node.elts]
+            return lambda metadata, value: [item(metadata, value) for item in items]
+        if isinstance(node, (ast.Name, ast.Attribute, ast.Subscript)):
+            root, keys = _path(node)
+            if root in METADATA_NAMES:
+                return lambda metadata, value: lookup(metadata[root], keys)
+            self.uses_value = True
+            keys = [root] + keys
+            return lambda metadata, value: lookup(value, keys)
+        raise ValueError(f"Unsupported expression: {ast.unparse(node)}")
+
+    def _compare(self, node):
+        left = self.compile(node.left)
+        steps = [(_COMPARISONS[type(op)], self.compile(right)) for op, right in zip(node.ops, node.comparators)]
+
+        def compare(metadata, value):
+            a = left(metadata, value)
+            for function, right in steps:
+                b = right(metadata, value)
+                try:
+                    if not function(a, b):
+                        return False
+                except TypeError:
+                    # None or mismatched types never match
+                    return False
+                a = b
+            return True
+
+        return compare
+
+
+def _literals(node):
+    """String literals a matching value must contain, from `field == 'literal'` terms of a top level and."""
+    terms = node.values if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And) else [node]
+    literals = []
+    for term in terms:
+        if not (isinstance(term, ast.Compare) and len(term.ops) == 1 and isinstance(term.ops[0], ast.Eq)):
+            continue
+        for field, constant in ((term.left, term.comparators[0]), (term.comparators[0], term.left)):
+            if isinstance(constant, ast.Constant) and isinstance(constant.value, str) \
+                    and isinstance(field, (ast.Name, ast.Attribute, ast.Subscript)) \
+                    and _path(field)[0] not in METADATA_NAMES:
+                text = json.dumps(constant.value)
+                # Strings JSON encoders may escape differently are not looked for
+                if text[1:-1] == constant.value and constant.value.isascii():
+                    literals.append(text.encode('ascii'))
+    return literals
+
+
+class MessageFilter:
+    """
+    Selects and projects consumed messages, decoding only the values which may match.
+
+    The expression is Python syntax evaluated safely: comparisons, in,
+    and/or/not, constants and lists, and field paths of the JSON value like
+    msn or reading.meter['msn']. _key, _timestamp (ms), _partition, _offset
+    and _headers['name'] refer to the message itself. Missing fields are
+    None and never compare true.
+
+    Checks run cheapest first: key, headers and timestamp range before the
+    value is decoded, then the raw value bytes must contain every string
+    compared with == at the top level of the expression as its JSON text,
+    and only then is the value decoded and the expression evaluated. fields
+    projects the decoded value onto some field paths.
+    """
+
+    def __init__(self, expression=None, key=None, headers=None, since_ms=None, until_ms=None, fields=None):
+        self.expression = expression
+        self.key = key.encode('utf-8') if isinstance(key, str) else key
+        self.headers = {name: value.encode('utf-8') for name, value in (headers or {}).items()}
+        self.since_ms = since_ms
+        self.until_ms = until_ms
+        self.fields = [(field, field_path(field)) for field in fields or ()]
+        self.checked = 0
+        self.decoded = 0
+        self.matched = 0
+        self._literals = []
+        self._metadata_test = None
+        self._value_test = None
+        if expression:
+            tree = ast.parse(expression, mode='eval')
+            compiler = _Compiler()
+            test = compiler.compile(tree)
+            if compiler.uses_value:
+                self._value_test = test
+                self._literals = _literals(tree.body)
+            else:
+                self._metadata_test = test
+
+    @classmethod
+    def from_spec(cls, spec):
+        """Build a filter from the dict of its arguments, e.g. in a worker process."""
+        return cls(**spec) if spec else None
+
+    def _accepts_message(self, message):
+        if self.key is not None and message.key != self.key:
+            return False
+        if self.since_ms is not None and message.timestamp < self.since_ms:
+            return False
+        if self.until_ms is not None and message.timestamp >= self.until_ms:
+            return False
+        if self.headers:
+            headers = dict(message.headers or ())
+            if any(headers.get(name) != value for name, value in self.headers.items()):
+                return False
+        if self._metadata_test is not None and not self._metadata_test(_metadata(message), None):
+            return False
+        raw = message.value
+        if self._literals and isinstance(raw, bytes) and not all(literal in raw for literal in self._literals):
+            return False
+        return True
+
+    def apply(self, message, decode):
+        """
+        Return the decoded, projected value of a matching message, or NO_MATCH.
+
+        decode turns the raw value into a document; it is called only for
+        messages passing the cheap checks.
+        """
+        self.checked += 1
+        if not self._accepts_message(message):
+            return NO_MATCH
+        value = decode(message.value)
+        self.decoded += 1
+        if self._value_test is not None and not self._value_test(_metadata(message), value):
+            return NO_MATCH
+        self.matched += 1
+        if self.fields:
+            value = {field: lookup(value, keys) for field, keys in self.fields}
+        return value
+
+    def summary(self):
+        return f"{self.matched} of {self.checked} messages matched, {self.decoded} decoded"
+
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import os
+import sqlite3
+
+from debuggingkafka.kafka_debugging.filters import field_path, lookup
+
+FORMAT_STORE = 'store'
+
+INDEX_FILE = 'index.sqlite'
+# Index rows collected before the segments are flushed and the rows committed
+COMMIT_ROWS = 5000
+# Seconds a worker waits for another one holding the index write lock
+LOCK_TIMEOUT = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS messages (
+    partition INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    timestamp INTEGER NOT NULL,
+    key TEXT,
+    segment TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    PRIMARY KEY (partition, offset)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS messages_timestamp ON messages (timestamp);
+CREATE INDEX IF NOT EXISTS messages_key ON messages (key, timestamp);
+"""
+
+
+def _text(value):
+    return value.decode('utf-8', 'replace') if isinstance(value, bytes) else value
+
+
+def _connect(directory):
+    connection = sqlite3.connect(os.path.join(directory, INDEX_FILE), timeout=LOCK_TIMEOUT)
+    connection.execute('PRAGMA journal_mode=WAL')
+    return connection
+
+
+class SegmentStore:
+    """
+    Captures messages to a local store of segment files with an SQLite index.
+
+    Segments are uncompressed JSON lines of {"message": ..., "metadata": ...}
+    per partition, a new one started once max_bytes went into the current
+    one. The index holds the timestamp, partition and offset, and key of
+    every message with its segment and byte range, so a message is read with
+    one seek. key is the value at the field path key_field, e.g. msn, or the
+    message key without one.
+
+    Capturing into an existing store adds the messages it does not have yet,
+    so the same incident can be captured again with a longer period. Several
+    processes may capture disjoint partitions into one store.
+    """
+
+    def __init__(self, directory, topic, key_field=None, max_bytes=256 << 20):
+        self.directory = directory
+        self.topic = topic
+        self.key_field = key_field
+        self.max_bytes = max_bytes
+        self.messages = 0
+        self.skipped = 0
+        self._keys = field_path(key_field) if key_field else None
+        # partition -> [file, segment name, size]
+        self._segments = {}
+        self._rows = []
+        os.makedirs(directory, exist_ok=True)
+        self._connection = _connect(directory)
+        with self._connection:
+            self._connection.executescript(_SCHEMA)
+            self._connection.execute("INSERT OR IGNORE INTO settings VALUES ('key_field', ?)", (key_field or '',))
+        (stored,) = self._connection.execute("SELECT value FROM settings WHERE name = 'key_field'").fetchone()
+        if stored != (key_field or ''):
+            raise ValueError(f"Store {directory} is indexed by key field {stored!r}, not {key_field!r}")
+        # partition -> (first, last) offset captured before, where messages are checked for duplicates
+        self._captured = {
+            partition: (first, last) for partition, first, last in self._connection.execute(
+                'SELECT partition, min(offset), max(offset) FROM messages GROUP BY partition'
+            )
+        }
+
+    def _key(self, value, metadata):
+        key = lookup(value, self._keys) if self._keys else _text(metadata['key'])
+        return None if key is None else str(key)
+
+    def _is_captured(self, partition, offset):
+        first, last = self._captured.get(partition, (0, -1))
+        if not first <= offset <= last:
+            return False
+        return self._connection.execute('SELECT 1 FROM messages WHERE partition = ? AND offset = ?',
+                                        (partition, offset)).fetchone() is not None
+
+    def _segment(self, partition, offset):
+        segment = self._segments.get(partition)
+        if segment is None or segment[2] >= self.max_bytes:
+            if segment is not None:
+                segment[0].close()
+            name = f"{self.topic}-{partition:03d}-{offset:012d}.seg"
+            file_ = open(os.path.join(self.directory, name), 'ab')
+            segment = self._segments[partition] = [file_, name, file_.tell()]
+        return segment
+
+    def write(self, value, metadata):
+        partition, offset = metadata['partition'], metadata['offset']
+        if self._is_captured(partition, offset):
+            self.skipped += 1
+            return
+        record = {'message': value, 'metadata': metadata}
+        line = json.dumps(record, default=str, separators=(',', ':')).encode('utf-8') + b'\n'
+        segment = self._segment(partition, offset)
+        segment[0].write(line)
+        self._rows.append((partition, offset, metadata['timestamp'], self._key(value, metadata),
+                           segment[1], segment[2], len(line)))
+        segment[2] += len(line)
+        self.messages += 1
+        if len(self._rows) >= COMMIT_ROWS:
+            self.commit()
+
+    def commit(self):
+        """Flush the segments, then index their new messages, so the index never points past the data."""
+        for file_, _, _ in self._segments.values():
+            file_.flush()
+        with self._connection:
+            self._connection.executemany('INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?)', self._rows)
+        self._rows = []
+
+    def close(self):
+        self.commit()
+        for file_, _, _ in self._segments.values():
+            file_.close()
+        self._segments = {}
+        self._connection.close()
+        logging.info(f"Stored {self.messages} messages in {self.directory}, {self.skipped} already captured")
+
+
+def query_store(directory, key=None, partition=None, offset=None, since_ms=None, until_ms=None, limit=None):
+    """
+    Yield the records of a store matching all given conditions, in timestamp order.
+
+    Only the index and the byte ranges of the matches are read; no broker is
+    involved.
+    """
+    if not os.path.exists(os.path.join(directory, INDEX_FILE)):
+        raise FileNotFoundError(f"No store in {directory}")
+    conditions = []
+    parameters = []
+    for column, operator, value in (('key', '=', key), ('partition', '=', partition), ('offset', '=', offset),
+                                    ('timestamp', '>=', since_ms), ('timestamp', '<', until_ms)):
+        if value is not None:
+            conditions.append(f"{column} {operator} ?")
+            parameters.append(value)
+    sql = 'SELECT segment, position, length FROM messages'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY timestamp, partition, offset'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        parameters.append(limit)
+    connection = sqlite3.connect(f"file:{os.path.join(directory, INDEX_FILE)}?mode=ro", uri=True)
+    files = {}
+    try:
+        for segment, position, length in connection.execute(sql, parameters):
+            file_ = files.get(segment)
+            if file_ is None:
+                file_ = files[segment] = open(os.path.join(directory, segment), 'rb')
+            file_.seek(position)
+            yield json.loads(file_.read(length))
+    finally:
+        for file_ in files.values():
+            file_.close()
+        connection.close()
@@ -6,15 +6,25 @@ import configparser
 import json
 import logging
 import logging.handlers
+import multiprocessing
 import os
+import shutil
 import sys
-from datetime import datetime, timedelta
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 from threading import Lock
 
 from kafka import TopicPartition
 
 from debuggingkafka.kafka_client import KafkaConfig
 from debuggingkafka.kafka_client.kafka_consumer import KafkaConsumerClient
+from debuggingkafka.kafka_debugging.filters import NO_MATCH, MessageFilter
+from debuggingkafka.kafka_debugging.store import FORMAT_STORE, SegmentStore, query_store
+from debuggingkafka.kafka_debugging.writers import FORMAT_JSONL, FORMAT_PARQUET, PartitionedDump, merge_dumps
+
+# Records returned by one poll()
+POLL_RECORDS = 5000
 
 
 class ConfigManager:
@@ -39,6 +49,9 @@ class ConfigManager:
             ('kafka', 'topic_retention_ms', 'KAFKA_TOPIC_RETENTION_MS', '15552000000'),
             ('kafka', 'flush_timeout_s', 'KAFKA_FLUSH_TIMEOUT_S', '60.0'),
             ('json_file', 'kafka_output_dir', 'kafka_output_dir', 'C:\\test-data\\kafka-output-dir'),
+            ('json_file', 'format', 'KAFKA_OUTPUT_FORMAT', 'jsonl'),
+            ('json_file', 'rotate_mb', 'KAFKA_OUTPUT_ROTATE_MB', '256'),
+            ('json_file', 'rotate_minutes', 'KAFKA_OUTPUT_ROTATE_MINUTES', '60'),
             ('period', 'in_hours', 'in_hours', '24'),
         ]
         for section, key, envkey, default in defaults:
@@ -63,6 +76,36 @@ class ArgumentManager:
         parser.add_argument('--debug-kafka', action='store_true', help='Enable Kafka logging')
         parser.add_argument('--log-file-retention-days', type=int, default=180, help='Log file retention in days')
         parser.add_argument('--config-file', default='config.conf', help='Configuration file path')
+        parser.add_argument('--output-dir', help='Directory of the dump files, overrides kafka_output_dir')
+        parser.add_argument('--format', choices=(FORMAT_JSONL, FORMAT_PARQUET, FORMAT_STORE),
+                            help='Dump file format, overrides the configuration file; store captures '
+                                 'to an indexed store for the query command')
+        parser.add_argument('--index-key', help='Field path of the value the store indexes, e.g. msn; '
+                                                'the message key by default')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Worker processes, each consuming its share of the partitions')
+        parser.add_argument('--merge', action='store_true',
+                            help='Merge the partitions into one output ordered by timestamp')
+        parser.add_argument('--filter', dest='expression',
+                            help="Only dump messages matching an expression, e.g. \"msn == 'X' and _key == 'k'\"")
+        parser.add_argument('--key', help='Only dump messages with this key')
+        parser.add_argument('--header', type=_header, action='append', default=[], metavar='NAME=VALUE',
+                            help='Only dump messages with this header value, may be repeated')
+        parser.add_argument('--since', type=_timestamp_ms, help='Only dump messages from this ISO time on')
+        parser.add_argument('--until', type=_timestamp_ms, help='Only dump messages before this ISO time')
+        parser.add_argument('--fields', type=lambda text: [field.strip() for field in text.split(',')],
+                            help='Comma separated field paths of the value to dump, e.g. msn,reading.value')
+
+        commands = parser.add_subparsers(dest='command')
+        query = commands.add_parser('query', help='Look up messages in a store captured with --format store, '
+                                                  'without connecting to Kafka')
+        query.add_argument('store', nargs='?', help='Store directory, kafka_output_dir by default')
+        query.add_argument('--key', dest='query_key', help='Messages with this value of the indexed key')
+        query.add_argument('--partition', type=int, help='Messages of this partition')
+        query.add_argument('--offset', type=int, help='The message at this offset, with --partition')
+        query.add_argument('--since', dest='query_since', type=_timestamp_ms, help='Messages from this ISO time on')
+        query.add_argument('--until', dest='query_until', type=_timestamp_ms, help='Messages before this ISO time')
+        query.add_argument('--limit', type=int, help='Return at most this many messages')
         return parser.parse_args()
 
 
@@ -87,6 +130,25 @@ class LoggerManager:
         logging.getLogger().addHandler(file_handler)
 
 
+def _decode(value):
+    return None if value is None else json.loads(value)
+
+
+def _timestamp_ms(text):
+    """Milliseconds since the epoch of an ISO 8601 time, UTC unless it has an offset."""
+    moment = datetime.fromisoformat(text)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+def _header(text):
+    name, separator, value = text.partition('=')
+    if not separator:
+        raise argparse.ArgumentTypeError(f"Expected NAME=VALUE, got {text!r}")
+    return name, value
+
+
 class KafkaDebug:
     """Handles Kafka message consumption and processing."""
 
@@ -100,46 +162,107 @@ class KafkaDebug:
                 cls._instance._initialize(kafka_config, period)
         return cls._instance
 
+    @classmethod
+    def unshared(cls, kafka_config, period):
+        """A debugger with a consumer of its own, closed by the caller, instead of the shared instance."""
+        instance = super(KafkaDebug, cls).__new__(cls)
+        instance._initialize(kafka_config, period)
+        return instance
+
     def _initialize(self, kafka_conf: KafkaConfig, period=None):
         self.kafka_conf = kafka_conf
         self.period = period
-        self.client = KafkaConsumerClient(kafka_conf)
-
-    def consume_messages(self, process_message):
-        """Consume messages from Kafka and process them based on the time period."""
+        # Values are decoded here, after filters had a chance to skip them
+        self.client = KafkaConsumerClient(kafka_conf, subscribe=False, decode=False)
+
+    def partitions(self):
+        """The partition numbers of the topic."""
+        return sorted(self.client.consumer.partitions_for_topic(self.kafka_conf.get_config().get('topic')))
+
+    def period_start_ms(self):
+        """The timestamp of the start of the period, e.g. 24 hours ago."""
+        return int((datetime.now(timezone.utc) - timedelta(hours=int(self.period))).timestamp() * 1000)
+
+    def _assign_from(self, timestamp_ms, partitions=None):
+        """
+        Assign the partitions, all of the topic by default, at the first offset at or after a time.
+
+        Returns the end offset of every partition at the start, the offset
+        the dump of the partition stops at.
+        """
+        consumer = self.client.consumer
+        topic = self.kafka_conf.get_config().get('topic')
+        partitions = [TopicPartition(topic, partition) for partition in (partitions or self.partitions())]
+        consumer.assign(partitions)
+        end_offsets = consumer.end_offsets(partitions)
+        offsets_for_times = consumer.offsets_for_times({partition: timestamp_ms for partition in partitions})
+        for partition in partitions:
+            found = offsets_for_times[partition]
+            # No message since the time, nothing to dump
+            consumer.seek(partition, found.offset if found is not None else end_offsets[partition])
+        return end_offsets
+
+    def consume_messages(self, process_message, partitions=None, timestamp_ms=None, message_filter=None,
+                         raise_errors=False):
+        """
+        Consume the messages of the time period and process them, up to the end offsets at the start.
+
+        partitions limits consumption to some partitions of the topic, and
+        timestamp_ms overrides the start of the period. With a MessageFilter
+        only matching messages are decoded and processed, projected onto its
+        fields. Errors are logged, or raised with raise_errors.
+        """
         try:
-            # Get the timestamp for the offset (e.g., 24 hours ago or based on self.period)
-            period_hours = int(self.period)
-            now = datetime.utcnow()
-            period_start = now - timedelta(hours=period_hours)
-            timestamp_ms = int(period_start.timestamp() * 1000)
-
-            # Seek to the offset corresponding to the timestamp
-            for partition in self.client.consumer.partitions_for_topic(self.kafka_conf.get_config().get('topic')):
-                topic_partition = TopicPartition(self.kafka_conf.get_config().get('topic'), partition)
-                offsets_for_times = self.client.consumer.offsets_for_times({topic_partition: timestamp_ms})
-                if offsets_for_times[topic_partition] is not None:
-                    self.client.consumer.seek(topic_partition, offsets_for_times[topic_partition].offset)
-            # Start consuming messages from the sought offset
+            if timestamp_ms is None:
+                timestamp_ms = self.period_start_ms()
+
             if self.client.consumer is None:
                 logging.info('No consumer available for topic %s', self.client.consumer)
                 sys.exit(0)
-            for message in self.client.consumer:
-                metadata = {
-                    'topic': message.topic,
-                    'partition': message.partition,
-                    'offset': message.offset,
-                    'timestamp': message.timestamp,
-                    'key': message.key,
-                    'headers': message.headers,
-                }
-                process_message(message.value, metadata)
+            consumer = self.client.consumer
+            end_offsets = self._assign_from(timestamp_ms, partitions)
+            remaining = {partition for partition, end in end_offsets.items() if consumer.position(partition) < end}
+            consumer.pause(*(set(end_offsets) - remaining))
+            while remaining:
+                batches = consumer.poll(timeout_ms=1000, max_records=POLL_RECORDS)
+                for partition, messages in batches.items():
+                    end = end_offsets[partition]
+                    for message in messages:
+                        if message.offset >= end:
+                            break
+                        if message_filter is None:
+                            value = _decode(message.value)
+                        else:
+                            value = message_filter.apply(message, _decode)
+                            if value is NO_MATCH:
+                                continue
+                        metadata = {
+                            'topic': message.topic,
+                            'partition': message.partition,
+                            'offset': message.offset,
+                            'timestamp': message.timestamp,
+                            'key': message.key,
+                            'headers': message.headers,
+                        }
+                        process_message(value, metadata)
+                    if partition in remaining and consumer.position(partition) >= end:
+                        remaining.discard(partition)
+                        consumer.pause(partition)
+                        logging.info(f"Reached end offset {end} of {partition}")
+            if message_filter is not None:
+                logging.info(f"Filter: {message_filter.summary()}")
         except AttributeError as a:
             logging.error(f"AttributeError encountered: {a}, no data to consume...")
+            if raise_errors:
+                raise
         except TypeError as typeError:
             logging.error(f"{typeError}, no data to consume...")
+            if raise_errors:
+                raise
         except Exception as e:
             logging.error(f"Failed to consume message: {e}")
+            if raise_errors:
+                raise
 
     @staticmethod
     def process_messages(messages, metadata):
@@ -151,12 +274,37 @@ class KafkaDebug:
             logging.error(f"Error processing message: {e}")
 
 
+def open_dump(directory, topic, output_format, max_bytes, max_seconds, index_key=None):
+    """The writer of consumed messages for an output format."""
+    if output_format == FORMAT_STORE:
+        return SegmentStore(directory, topic, index_key, max_bytes)
+    return PartitionedDump(directory, topic, output_format, max_bytes, max_seconds)
+
+
+def dump_partitions(kafka_args, period, partitions, timestamp_ms, directory, output_format, max_bytes, max_seconds,
+                    filter_spec=None, index_key=None):
+    """Dump some partitions with a consumer of their own; runs in a worker process."""
+    logging.basicConfig(format="%(asctime)s  %(levelname)-5s  %(message)s", level=logging.INFO)
+    # A worker runs several of these tasks, each with a consumer of its own
+    debugger = KafkaDebug.unshared(KafkaConfig(**kafka_args), period)
+    dump = open_dump(directory, kafka_args['topic'], output_format, max_bytes, max_seconds, index_key)
+    try:
+        debugger.consume_messages(dump.write, partitions, timestamp_ms, MessageFilter.from_spec(filter_spec),
+                                  raise_errors=True)
+    finally:
+        dump.close()
+        debugger.client.close()
+    if output_format == FORMAT_STORE:
+        return {}
+    return {partition: writer.messages for partition, writer in dump.writers.items()}
+
+
 class KafkaApp:
     """Main application class that initializes all components and runs the Kafka consumer."""
 
-    def __init__(self):
+    def __init__(self, args=None):
         # Initialize argument and configuration managers
-        self.args = ArgumentManager().args
+        self.args = args or ArgumentManager().args
         self.config = ConfigManager(self.args.config_file).config
 
         # Initialize logging
@@ -179,19 +327,104 @@ class KafkaApp:
             'topic_retention_ms': int(self.config['kafka']['topic_retention_ms']),
             'flush_timeout_s': float(self.config['kafka']['flush_timeout_s']),
         }
+        self.kafka_args = kafka_args
         self.kafka_debugger = KafkaDebug(KafkaConfig(**kafka_args), period=self.args.hours)
 
+    def filter_spec(self):
+        """The MessageFilter arguments of the command line, None without any filter."""
+        spec = {
+            'expression': self.args.expression,
+            'key': self.args.key,
+            'headers': dict(self.args.header) or None,
+            'since_ms': self.args.since,
+            'until_ms': self.args.until,
+            'fields': self.args.fields,
+        }
+        spec = {name: value for name, value in spec.items() if value is not None}
+        return spec or None
+
+    def start_ms(self):
+        """Where consumption starts: the start of the period, or --since when that is later."""
+        start = self.kafka_debugger.period_start_ms()
+        return max(start, self.args.since) if self.args.since is not None else start
+
     def run(self):
-        """Start consuming Kafka messages and processing them."""
-        self.kafka_debugger.consume_messages(self.kafka_debugger.process_messages)
+        """Dump the Kafka messages of the period to the output directory."""
+        output = self.config['json_file']
+        directory = self.args.output_dir or output['kafka_output_dir']
+        output_format = self.args.format or output['format']
+        max_bytes = int(float(output['rotate_mb']) * (1 << 20))
+        max_seconds = float(output['rotate_minutes']) * 60
+        if output_format == FORMAT_STORE and self.args.merge:
+            logging.info('The store index orders all partitions by timestamp, --merge is ignored')
+            self.args.merge = False
+        if self.args.workers > 1 or self.args.merge:
+            self.run_parallel(directory, output_format, max_bytes, max_seconds)
+            return
+        dump = open_dump(directory, self.config['kafka']['topic'], output_format, max_bytes, max_seconds,
+                         self.args.index_key)
+        try:
+            self.kafka_debugger.consume_messages(dump.write, timestamp_ms=self.start_ms(),
+                                                 message_filter=MessageFilter.from_spec(self.filter_spec()))
+        finally:
+            dump.close()
+
+    def run_parallel(self, directory, output_format, max_bytes, max_seconds):
+        """
+        Dump groups of partitions in worker processes, each with its own consumer.
+
+        Workers write per partition files, which with --merge go to a
+        staging directory and are merged into one series ordered by timestamp.
+        """
+        partitions = self.kafka_debugger.partitions()
+        timestamp_ms = self.start_ms()
+        workers = max(min(self.args.workers, len(partitions)), 1)
+        target = os.path.join(directory, f".partitions-{os.getpid()}") if self.args.merge else directory
+        logging.info(f"Dumping {len(partitions)} partitions with {workers} workers")
+        # Spawned, so workers do not inherit the connections of this process
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [
+                pool.submit(dump_partitions, self.kafka_args, self.args.hours, partitions[i::workers], timestamp_ms,
+                            target, output_format, max_bytes, max_seconds, self.filter_spec(), self.args.index_key)
+                for i in range(workers)
+            ]
+            for future in as_completed(futures):
+                for partition, messages in sorted(future.result().items()):
+                    logging.info(f"Partition {partition}: {messages} messages")
+        if self.args.merge:
+            merge_dumps(target, directory, self.config['kafka']['topic'], output_format, max_bytes, max_seconds)
+            shutil.rmtree(target)
 
     @staticmethod
     def parse_bool(value):
         return value.lower() in ('true', 't', '1', 'y', 'yes')
 
 
+def run_query(args):
+    """Print the stored messages matching the query command's conditions as JSON lines."""
+    config = ConfigManager(args.config_file).config
+    directory = args.store or args.output_dir or config['json_file']['kafka_output_dir']
+    start_time = time.monotonic()
+    count = 0
+    try:
+        for record in query_store(directory, key=args.query_key, partition=args.partition, offset=args.offset,
+                                  since_ms=args.query_since, until_ms=args.query_until, limit=args.limit):
+            print(json.dumps(record))
+            count += 1
+    except FileNotFoundError as e:
+        logging.error(f"{e}, capture one with --format store")
+        sys.exit(1)
+    logging.info(f"{count} messages found in {(time.monotonic() - start_time) * 1000:.1f}ms")
+
+
 def main():
-    KafkaApp().run()
+    args = ArgumentManager().args
+    if args.command == 'query':
+        # No broker connection is made for queries
+        LoggerManager(log_file=args.log_file, debug=args.debug, retention_days=args.log_file_retention_days)
+        run_query(args)
+        return
+    KafkaApp(args).run()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import glob
+import gzip
+import heapq
+import json
+import logging
+import os
+import time
+
+FORMAT_JSONL = 'jsonl'
+FORMAT_PARQUET = 'parquet'
+
+# Bytes of JSON lines collected before they are compressed in one write
+WRITE_BUFFER_BYTES = 1 << 20
+# Partition label of files merged from all partitions
+MERGED_LABEL = 'merged'
+
+
+def _record(value, metadata):
+    return {'message': value, 'metadata': metadata}
+
+
+class PartitionWriter:
+    """
+    Writes the messages of one partition to a series of files.
+
+    A file is finished and a new one started once max_bytes of uncompressed
+    data or max_seconds have gone into it. Files are named after the topic
+    and the partition and their first offset, or MERGED_LABEL and their
+    sequence number for merged output, and carry a .tmp suffix until they
+    are finished; existing files are never overwritten.
+    """
+
+    extension = None
+
+    def __init__(self, directory, topic, partition, max_bytes, max_seconds):
+        self.directory = directory
+        self.topic = topic
+        self.partition = partition
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.messages = 0
+        self.files = 0
+        self.path = None
+        self._bytes = 0
+        self._started = 0.0
+
+    def _open(self, first_offset):
+        if isinstance(self.partition, int):
+            name = f"{self.topic}-{self.partition:03d}-{first_offset:012d}.{self.extension}"
+        else:
+            # Offsets of merged partitions repeat, so merged files are numbered
+            name = f"{self.topic}-{self.partition}-{self.files:06d}.{self.extension}"
+        self.path = os.path.join(self.directory, name)
+        self._bytes = 0
+        self._started = time.monotonic()
+
+    def _finish(self):
+        if os.path.exists(self.path):
+            raise FileExistsError(f"{self.path} already exists, the new file is left as {self.path}.tmp")
+        os.replace(f"{self.path}.tmp", self.path)
+        self.files += 1
+        logging.info(f"Wrote {self.path}")
+        self.path = None
+
+    def write(self, value, metadata):
+        if self.path is None:
+            self._open(metadata['offset'])
+        self._bytes += self._append(value, metadata)
+        self.messages += 1
+        if self._bytes >= self.max_bytes or time.monotonic() - self._started >= self.max_seconds:
+            self.close()
+
+    def _append(self, value, metadata) -> int:
+        """Buffer a message and return its uncompressed size."""
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+
+class JsonlWriter(PartitionWriter):
+    """Gzip compressed JSON lines of {"message": ..., "metadata": ...}."""
+
+    extension = 'jsonl.gz'
+
+    def __init__(self, directory, topic, partition, max_bytes, max_seconds, compresslevel=6):
+        super().__init__(directory, topic, partition, max_bytes, max_seconds)
+        self.compresslevel = compresslevel
+        self._file = None
+        self._buffer = []
+        self._buffered = 0
+
+    def _open(self, first_offset):
+        super()._open(first_offset)
+        self._file = gzip.open(f"{self.path}.tmp", 'wb', compresslevel=self.compresslevel)
+
+    def _append(self, value, metadata):
+        line = json.dumps(_record(value, metadata), default=str, separators=(',', ':')).encode('utf-8') + b'\n'
+        self._buffer.append(line)
+        self._buffered += len(line)
+        if self._buffered >= WRITE_BUFFER_BYTES:
+            self._flush()
+        return len(line)
+
+    def _flush(self):
+        self._file.write(b''.join(self._buffer))
+        self._buffer = []
+        self._buffered = 0
+
+    def close(self):
+        if self._file is None:
+            return
+        self._flush()
+        self._file.close()
+        self._file = None
+        self._finish()
+
+
+class ParquetWriter(PartitionWriter):
+    """
+    zstd compressed Parquet files, one row per message.
+
+    Columns are the message metadata, with headers as JSON text, and the
+    value as JSON text. Parquet files cannot be appended to, so the rows of
+    a file are kept in memory until it is finished.
+    """
+
+    extension = 'parquet'
+
+    def __init__(self, directory, topic, partition, max_bytes, max_seconds):
+        super().__init__(directory, topic, partition, max_bytes, max_seconds)
+        self._columns = None
+
+    def _open(self, first_offset):
+        super()._open(first_offset)
+        self._columns = {name: [] for name in ('topic', 'partition', 'offset', 'timestamp', 'key', 'headers',
+                                               'value')}
+
+    def _append(self, value, metadata):
+        text = json.dumps(value, default=str, separators=(',', ':'))
+        key = metadata['key']
+        self._columns['topic'].append(metadata['topic'])
+        self._columns['partition'].append(metadata['partition'])
+        self._columns['offset'].append(metadata['offset'])
+        self._columns['timestamp'].append(metadata['timestamp'])
+        self._columns['key'].append(key.decode('utf-8', 'replace') if isinstance(key, bytes) else key)
+        self._columns['headers'].append(
+            json.dumps([(name, header.decode('utf-8', 'replace')) for name, header in metadata['headers'] or ()]))
+        self._columns['value'].append(text)
+        return len(text) + 64
+
+    def close(self):
+        if self._columns is None:
+            return
+        import polars as pl
+        frame = pl.DataFrame(self._columns, schema={
+            'topic': pl.Utf8, 'partition': pl.Int32, 'offset': pl.Int64, 'timestamp': pl.Int64,
+            'key': pl.Utf8, 'headers': pl.Utf8, 'value': pl.Utf8,
+        })
+        frame = frame.with_columns(pl.from_epoch('timestamp', time_unit='ms'))
+        frame.write_parquet(f"{self.path}.tmp", compression='zstd', statistics=True)
+        self._columns = None
+        self._finish()
+
+
+_WRITERS = {FORMAT_JSONL: JsonlWriter, FORMAT_PARQUET: ParquetWriter}
+
+
+class PartitionedDump:
+    """Routes consumed messages to one rotating writer per partition."""
+
+    def __init__(self, directory, topic, output_format=FORMAT_JSONL, max_bytes=256 << 20, max_seconds=3600):
+        if output_format not in _WRITERS:
+            raise ValueError(f"Unknown output format {output_format!r}, use one of {', '.join(_WRITERS)}")
+        self.directory = directory
+        self.topic = topic
+        self.writer_class = _WRITERS[output_format]
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.writers = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, value, metadata):
+        writer = self.writers.get(metadata['partition'])
+        if writer is None:
+            writer = self.writers[metadata['partition']] = self.writer_class(
+                self.directory, self.topic, metadata['partition'], self.max_bytes, self.max_seconds
+            )
+        writer.write(value, metadata)
+
+    def close(self):
+        for partition, writer in sorted(self.writers.items()):
+            writer.close()
+            logging.info(f"Partition {partition}: {writer.messages} messages in {writer.files} files")
+
+
+def _jsonl_records(paths):
+    """Yield (timestamp, partition, offset, record) of the JSON lines files of one partition."""
+    for path in paths:
+        with gzip.open(path, 'rb') as file_:
+            for line in file_:
+                record = json.loads(line)
+                metadata = record['metadata']
+                yield metadata['timestamp'], metadata['partition'], metadata['offset'], record
+
+
+def merge_dumps(source_dir, directory, topic, output_format=FORMAT_JSONL, max_bytes=256 << 20, max_seconds=3600):
+    """
+    Merge per partition dump files into one series ordered by timestamp.
+
+    Each partition's files are read in offset order and merged by message
+    timestamp, ties broken by partition and offset; a partition's messages
+    with out of order timestamps keep their offset order. JSON lines are
+    streamed into rotating files; Parquet files are sorted by polars into a
+    single file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    if output_format == FORMAT_PARQUET:
+        import polars as pl
+        paths = sorted(glob.glob(os.path.join(source_dir, f"{topic}-*.parquet")))
+        if not paths:
+            return
+        path = os.path.join(directory, f"{topic}-{MERGED_LABEL}.parquet")
+        if os.path.exists(path):
+            raise FileExistsError(f"{path} already exists")
+        pl.scan_parquet(paths).sort(['timestamp', 'partition', 'offset']).sink_parquet(
+            f"{path}.tmp", compression='zstd', statistics=True
+        )
+        os.replace(f"{path}.tmp", path)
+        logging.info(f"Wrote {path}")
+        return
+    by_partition = {}
+    for path in sorted(glob.glob(os.path.join(source_dir, f"{topic}-*.jsonl.gz"))):
+        partition = int(os.path.basename(path)[len(topic) + 1:].split('-')[0])
+        by_partition.setdefault(partition, []).append(path)
+    writer = JsonlWriter(directory, topic, MERGED_LABEL, max_bytes, max_seconds)
+    for _, _, _, record in heapq.merge(*(_jsonl_records(paths) for paths in by_partition.values()),
+                                            key=lambda item: item[:3]):
+        writer.write(record['message'], record['metadata'])
+    writer.close()
+    logging.info(f"Merged {writer.messages} messages of {len(by_partition)} partitions into {writer.files} files")
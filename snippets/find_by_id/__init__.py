@@ -4,7 +4,7 @@
 import bisect
 import datetime
 import logging
-from typing import Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 
 log = logging.getLogger(__name__)
 
@@ -22,6 +22,42 @@ def datetime_to_epoch_seconds(dt: datetime.datetime) -> int:
 FIND_ID_LEFT = object()
 FIND_ID_RIGHT = object()
 
+SEARCH_BISECT = object()
+SEARCH_INTERPOLATE = object()
+
+# Number of candidate ids checked by one batched probe query
+PROBE_BRACKET_SIZE = 16
+# Id spans up to this size are resolved with a single range scan
+SCAN_THRESHOLD = 1024
+# Upper bound of probe subqueries sent in one query
+MAX_PROBES_PER_QUERY = 512
+
+
+class FindIdStats:
+    """Round trip accounting for a find_id call."""
+
+    def __init__(self):
+        self.round_trips = 0
+        self.probed_ids = 0
+
+    def __repr__(self):
+        return f"FindIdStats(round_trips={self.round_trips}, probed_ids={self.probed_ids})"
+
+
+class _CountingCursor:
+    """Cursor proxy that counts the queries sent to the server."""
+
+    def __init__(self, cur, stats: FindIdStats):
+        self._cur = cur
+        self._stats = stats
+
+    def execute(self, query, params=()):
+        self._stats.round_trips += 1
+        return self._cur.execute(query, params)
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
 
 def _execute_query(cur, query: str, params: Tuple = ()):
     """Executes a SQL query with error handling."""
@@ -62,11 +98,223 @@ def _get_record_by_id(cur, table_name: str, _id: int) -> Optional[Tuple[int, int
     return result[0] if result else None
 
 
+def _get_boundary_records(cur, table_name: str) -> List[Tuple[int, int]]:
+    """Fetch the first and the last record of the table in one query."""
+    query = (
+        f"""
+        (SELECT id, UNIX_TIMESTAMP(create_time) FROM {table_name} ORDER BY id ASC LIMIT 1)
+        UNION ALL
+        (SELECT id, UNIX_TIMESTAMP(create_time) FROM {table_name} ORDER BY id DESC LIMIT 1);
+        """
+    )
+    return [(int(_id), int(ts)) for _id, ts in _execute_query(cur, query)]
+
+
+def _get_records_from_ids(cur, table_name: str, ids: List[int]) -> List[Tuple[int, int, int]]:
+    """Fetch the first record with ID >= each probe ID, all probes in one query.
+
+    Returns (probe_id, id, create_time) tuples; probes past the last row are omitted.
+    """
+    subquery = (
+        f"(SELECT %s, id, UNIX_TIMESTAMP(create_time) FROM {table_name} "
+        f"WHERE id >= %s ORDER BY id ASC LIMIT 1)"
+    )
+    query = " UNION ALL ".join([subquery] * len(ids))
+    params = tuple(param for _id in ids for param in (_id, _id))
+    result = _execute_query(cur, query, params)
+    return sorted((int(probe), int(_id), int(ts)) for probe, _id, ts in result)
+
+
+def _get_records_in_ranges(cur, table_name: str, ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Fetch all records with lo_id < id <= hi_id for every (lo_id, hi_id) range in one query."""
+    subquery = f"(SELECT id, UNIX_TIMESTAMP(create_time) FROM {table_name} WHERE id > %s AND id <= %s)"
+    query = " UNION ALL ".join([subquery] * len(ranges))
+    params = tuple(_id for id_range in ranges for _id in id_range)
+    return sorted((int(_id), int(ts)) for _id, ts in _execute_query(cur, query, params))
+
+
+def _merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Merge overlapping (lo_id, hi_id] ranges."""
+    merged = []
+    for lo_id, hi_id in sorted(ranges):
+        if merged and lo_id <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi_id))
+        else:
+            merged.append((lo_id, hi_id))
+    return merged
+
+
+def _matches(ts: int, sought: int, bisect_side: object) -> bool:
+    return ts > sought if bisect_side is FIND_ID_RIGHT else ts >= sought
+
+
+def _candidate_ids(lo_id: int, hi_id: int, estimate: Optional[int], bracket_size: int) -> List[int]:
+    """Pick the probe IDs inside (lo_id, hi_id].
+
+    Without an estimate the probes split the span evenly; with one they cover a
+    window of span / bracket_size IDs centered on the interpolated position.
+    """
+    span = hi_id - lo_id
+    if estimate is None:
+        start, width = lo_id + 1, span
+    else:
+        width = max(span // bracket_size, bracket_size)
+        start = min(max(estimate - width // 2, lo_id + 1), hi_id - width + 1)
+    step = width / (bracket_size + 1)
+    return sorted({start + int(step * (i + 1)) for i in range(bracket_size)})
+
+
+class _SearchState:
+    """
+    Search region of one sought create_time.
+
+    The answer is the first record matching the bisect side in (lo_id, hi_id],
+    or `best` when there is none. Unless `verified`, `best` is a sample point
+    that may have been purged since it was indexed, and is searched too.
+    """
+
+    def __init__(self, sought: int, lo: Tuple[int, int], best: Tuple[int, int], verified: bool):
+        self.sought = sought
+        self.lo_id, self.lo_ts = lo
+        self.best = best
+        self.verified = verified
+        self.hi_id = best[0] - 1 if verified else best[0]
+        self.interpolate = True
+        self.window = None
+        self.estimate = None
+
+    def span(self) -> int:
+        return self.hi_id - self.lo_id
+
+    def candidate_ids(self, bracket_size: int) -> List[int]:
+        self.estimate = None
+        if self.interpolate and self.best[1] > self.lo_ts:
+            fraction = (self.sought - self.lo_ts) / (self.best[1] - self.lo_ts)
+            self.estimate = self.lo_id + int(fraction * (self.best[0] - self.lo_id))
+        self.window = max(self.span() // bracket_size, bracket_size)
+        return _candidate_ids(self.lo_id, self.hi_id, self.estimate, bracket_size)
+
+    def apply(self, records: List[Tuple[int, int, int]], probes: List[int], bisect_side: object):
+        """Narrow the region with (probe_id, id, create_time) probe results sorted by probe."""
+        # The last probe at or below lo_id still tells which rows after lo_id are missing
+        start = max(bisect.bisect_right(probes, self.lo_id) - 1, 0)
+        for probe, _id, ts in records[start:]:
+            if _id <= self.lo_id:
+                continue
+            probe = max(probe, self.lo_id + 1)
+            if probe > self.hi_id:
+                break
+            if _id > self.hi_id or _matches(ts, self.sought, bisect_side):
+                # Nothing exists between this probe and _id, which matches
+                self.best, self.verified = (_id, ts), True
+                self.hi_id = probe - 1
+                break
+            self.lo_id, self.lo_ts = _id, ts
+        if self.estimate is not None:
+            # Keep interpolating only while the estimate lands in its window
+            self.interpolate = self.span() <= self.window
+
+
+def _search(
+        cur,
+        table_name: str,
+        sought_create_times: List[int],
+        bisect_side: object,
+        stats: Optional[FindIdStats] = None,
+        index=None,
+        bracket_size: int = PROBE_BRACKET_SIZE,
+        scan_threshold: int = SCAN_THRESHOLD
+) -> Dict[int, Optional[int]]:
+    """
+    Resolve sought create_times (epoch seconds) to IDs with batched probes.
+
+    Every step interpolates the position of each sought create_time in its
+    region and probes a bracket of candidate IDs around it. The probes of all
+    sought create_times go out in one query and every result narrows every
+    region it falls in. The first record at or after a probe ID is used, so
+    gaps left by purges never cost an extra round trip. An estimate missing
+    its window falls back to evenly spread probes, which bounds the worst case
+    by a bracket_size-ary search. Regions of at most scan_threshold IDs are
+    finished with one range scan query.
+    """
+    _set_session_timezone(cur)
+    brackets = {sought: index.bracket(sought, bisect_side) if index is not None else (None, None)
+                for sought in sorted(set(sought_create_times))}
+
+    first = last = None
+    if any(lo is None or hi is None for lo, hi in brackets.values()):
+        boundaries = _get_boundary_records(cur, table_name)
+        if not boundaries:
+            log.warning("Table is empty or does not exist.")
+            return {sought: None for sought in brackets}
+        first, last = boundaries[0], boundaries[-1]
+
+    found, states = {}, []
+    for sought, (lo, hi) in brackets.items():
+        verified = False
+        if lo is None:
+            # Sought before the index or without one, the table start may have been purged
+            if _matches(first[1], sought, bisect_side):
+                found[sought] = first[0]
+                continue
+            lo, hi = first, None
+        if hi is None:
+            if not _matches(last[1], sought, bisect_side):
+                found[sought] = None
+                continue
+            hi, verified = last, True
+        states.append(_SearchState(sought, lo, hi, verified))
+
+    while True:
+        active = [state for state in states if state.span() > scan_threshold]
+        if not active:
+            break
+        probes = sorted({probe for state in active for probe in state.candidate_ids(bracket_size)})
+        if stats is not None:
+            stats.probed_ids += len(probes)
+        records = []
+        for i in range(0, len(probes), MAX_PROBES_PER_QUERY):
+            records.extend(_get_records_from_ids(cur, table_name, probes[i:i + MAX_PROBES_PER_QUERY]))
+        probe_ids = [probe for probe, _, _ in records]
+        for state in states:
+            state.apply(records, probe_ids, bisect_side)
+
+    ranges = _merge_ranges([(state.lo_id, state.hi_id) for state in states if state.span() > 0])
+    scanned = _get_records_in_ranges(cur, table_name, ranges) if ranges else []
+    scanned_ids = [_id for _id, _ in scanned]
+    unverified = []
+    for state in states:
+        match = None
+        for _id, ts in scanned[bisect.bisect_right(scanned_ids, state.lo_id):]:
+            if _id > state.hi_id:
+                break
+            if _matches(ts, state.sought, bisect_side):
+                match = _id
+                break
+        if match is not None:
+            found[state.sought] = match
+        elif state.verified:
+            found[state.sought] = state.best[0]
+        else:
+            unverified.append(state)
+
+    if unverified:
+        # The indexed upper samples were purged, the first rows after them match
+        records = _get_records_from_ids(cur, table_name, [state.hi_id + 1 for state in unverified])
+        after = {probe: _id for probe, _id, _ in records}
+        for state in unverified:
+            found[state.sought] = after.get(state.hi_id + 1)
+    return found
+
+
 def find_id(
         cur,
         table_name: str,
         sought_create_time: datetime.datetime,
-        bisect_side: object
+        bisect_side: object,
+        search_mode: object = SEARCH_BISECT,
+        stats: Optional[FindIdStats] = None,
+        index=None
 ) -> Optional[int]:
     """
     Find the ID of the record closest to the sought create_time.
@@ -76,6 +324,11 @@ def find_id(
         table_name: Name of the table to query.
         sought_create_time: Target create_time as a datetime object.
         bisect_side: Either FIND_ID_LEFT or FIND_ID_RIGHT to control bisect behavior.
+        search_mode: SEARCH_BISECT probes one ID per query, SEARCH_INTERPOLATE
+            narrows the range by interpolation and probes a bracket of IDs per query.
+        stats: Optional FindIdStats collecting the number of round trips used.
+        index: Optional snippets.find_by_id.index.TimeIdIndex of the table. When
+            given, only the window between its sample points is searched.
 
     Returns:
         The ID of the matching record, or None if not found.
@@ -83,6 +336,17 @@ def find_id(
     if isinstance(sought_create_time, datetime.datetime):
         sought_create_time = datetime_to_epoch_seconds(sought_create_time)
 
+    if stats is not None:
+        cur = _CountingCursor(cur, stats)
+
+    if index is not None and not len(index):
+        index = None
+
+    if search_mode is SEARCH_INTERPOLATE or index is not None:
+        found_id = _search(cur, table_name, [sought_create_time], bisect_side, stats, index)[sought_create_time]
+        log.debug("find_id(%s, %s) resolved to %s, stats: %s", table_name, sought_create_time, found_id, stats)
+        return found_id
+
     # Get min and max IDs in the table
     min_id, max_id = _find_min_max_ids(cur, table_name)
     if min_id is None or max_id is None:
@@ -125,3 +389,47 @@ def find_id(
     except Exception as e:
         log.error(f"Error during binary search: {e}")
         return None
+
+
+def find_ids(
+        cur,
+        table_name: str,
+        sought_create_times: Iterable[datetime.datetime],
+        bisect_side: object,
+        stats: Optional[FindIdStats] = None,
+        index=None
+) -> Dict[datetime.datetime, Optional[int]]:
+    """
+    Find the IDs of the records closest to several sought create_times at once.
+
+    The sought create_times are searched together: the session is set up and
+    the table boundaries read once, every round probes all of them in one
+    query and each probe result is shared by all neighbouring searches, so the
+    whole set costs about as many queries as a single find_id.
+
+    Args:
+        cur: Database cursor.
+        table_name: Name of the table to query.
+        sought_create_times: Target create_times as datetime objects or epoch seconds.
+        bisect_side: Either FIND_ID_LEFT or FIND_ID_RIGHT to control bisect behavior.
+        stats: Optional FindIdStats collecting the number of round trips used.
+        index: Optional snippets.find_by_id.index.TimeIdIndex of the table.
+
+    Returns:
+        A mapping of each sought create_time to the matching ID, or None if not found.
+    """
+    sought = {
+        create_time: datetime_to_epoch_seconds(create_time)
+        if isinstance(create_time, datetime.datetime) else create_time
+        for create_time in sought_create_times
+    }
+    if not sought:
+        return {}
+    if stats is not None:
+        cur = _CountingCursor(cur, stats)
+    if index is not None and not len(index):
+        index = None
+
+    found = _search(cur, table_name, list(sought.values()), bisect_side, stats, index)
+    log.debug("find_ids(%s) resolved %d create_times, stats: %s", table_name, len(sought), stats)
+    return {create_time: found[epoch] for create_time, epoch in sought.items()}
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import bisect
+import logging
+import mmap
+import os
+import struct
+from typing import Optional, Tuple
+
+from snippets.find_by_id import (
+    FIND_ID_RIGHT,
+    _get_boundary_records,
+    _get_records_from_ids,
+    _set_session_timezone,
+)
+
+log = logging.getLogger(__name__)
+
+# One sample point per this many IDs
+DEFAULT_INDEX_STRIDE = 16384
+# Probe IDs sent per query while refreshing the index
+REFRESH_BATCH_SIZE = 256
+
+
+def index_path(directory: str, table_name: str) -> str:
+    """Return the path of the index file for a table kept in a directory."""
+    return os.path.join(directory, f".{table_name}.tidx")
+
+
+class TimeIdIndex:
+    """
+    Sparse on-disk index of (id, create_time) sample points of a table.
+
+    Samples are stored as fixed size little-endian int64 pairs appended to a
+    single file, ordered by id, and read through a memory map. create_time is
+    kept in epoch seconds as returned by UNIX_TIMESTAMP() with the session
+    timezone at +0:00.
+    """
+
+    RECORD = struct.Struct('<qq')
+
+    def __init__(self, path: str, stride: int = DEFAULT_INDEX_STRIDE):
+        self.path = path
+        self.stride = stride
+        self._file = None
+        self._map = None
+        self._open()
+
+    def _open(self):
+        self.close()
+        if not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        if size % self.RECORD.size:
+            log.warning("Index file %s is truncated, ignoring the partial record.", self.path)
+        if size < self.RECORD.size:
+            return
+        self._file = open(self.path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __len__(self) -> int:
+        return len(self._map) // self.RECORD.size if self._map is not None else 0
+
+    def __getitem__(self, index: int) -> Tuple[int, int]:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Index entry {index} out of range [0, {len(self)}).")
+        return self.RECORD.unpack_from(self._map, index * self.RECORD.size)
+
+    def last(self) -> Optional[Tuple[int, int]]:
+        """Return the last sample point, or None for an empty index."""
+        return self[-1] if len(self) else None
+
+    def bracket(self, sought: int, bisect_side: object) -> Tuple[Optional[Tuple[int, int]], Optional[Tuple[int, int]]]:
+        """
+        Return the sample points around the sought create_time.
+
+        The first point does not match the bisect side and the second one does;
+        either is None when the sought create_time lies outside the index.
+        """
+        index = self
+
+        class CreateTimes:
+            def __len__(self) -> int:
+                return len(index)
+
+            def __getitem__(self, i: int) -> int:
+                return index[i][1]
+
+        bisect_fn = bisect.bisect_right if bisect_side is FIND_ID_RIGHT else bisect.bisect_left
+        found = bisect_fn(CreateTimes(), sought, 0, len(self))
+        lo = self[found - 1] if found > 0 else None
+        hi = self[found] if found < len(self) else None
+        return lo, hi
+
+    def refresh(self, cur, table_name: str) -> int:
+        """
+        Append sample points for the rows beyond the last indexed ID.
+
+        Returns the number of points appended.
+        """
+        _set_session_timezone(cur)
+        boundaries = _get_boundary_records(cur, table_name)
+        if not boundaries:
+            log.warning("Table is empty or does not exist.")
+            return 0
+        first, last = boundaries[0], boundaries[-1]
+
+        indexed = self.last()
+        if indexed is not None and indexed[0] >= last[0]:
+            return 0
+        points = [] if indexed is not None else [first]
+        start = indexed[0] if indexed is not None else first[0]
+
+        probes = list(range(start + self.stride, last[0], self.stride))
+        for i in range(0, len(probes), REFRESH_BATCH_SIZE):
+            batch = probes[i:i + REFRESH_BATCH_SIZE]
+            points.extend((_id, ts) for _, _id, ts in _get_records_from_ids(cur, table_name, batch))
+        points.append(last)
+
+        appended = 0
+        prev_id, prev_ts = indexed if indexed is not None else (None, None)
+        with open(self.path, 'ab') as file_:
+            for _id, ts in sorted(set(points)):
+                # Keep the samples strictly ordered by id and never going back in time
+                if prev_id is not None and (_id <= prev_id or ts < prev_ts):
+                    continue
+                file_.write(self.RECORD.pack(_id, ts))
+                prev_id, prev_ts = _id, ts
+                appended += 1
+        self._open()
+        log.info("Index %s refreshed with %d new points, %d in total.", self.path, appended, len(self))
+        return appended
@@ -1,13 +1,13 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import json
 
 
 class KafkaConfig:
     def __init__(self, bootstrap_servers, topic, retries=5, linger_ms=100, username=None, password=None,
                  ssl_check_hostname=None, cafile=None, topic_partitions=None, topic_replication_factor=None,
-                 topic_retention_ms=None, flush_timeout_s=None, topic_group_id=None):
+                 topic_retention_ms=None, flush_timeout_s=None, topic_group_id=None, serializer='json',
+                 compression_type=None):
         self.__bootstrap_servers = bootstrap_servers
         self.__topic_group_id = topic_group_id
         self.__topic = topic
@@ -21,6 +21,8 @@ class KafkaConfig:
         self.__topic_replication_factor = topic_replication_factor
         self.__topic_retention_ms = topic_retention_ms
         self.__flush_timeout_s = flush_timeout_s
+        self.__serializer = serializer
+        self.__compression_type = compression_type
 
     def get_config(self):
         config = {
@@ -28,7 +30,7 @@ class KafkaConfig:
             'topic': self.__topic,
             'retries': self.__retries,
             'linger_ms': self.__linger_ms,
-            'value_deserializer': lambda v: json.loads(v.decode('utf-8')),
+            'serializer': self.__serializer,
         }
 
         if self.__username and self.__password:
@@ -65,6 +67,11 @@ class KafkaConfig:
                 'flush_timeout_ms': int(self.__flush_timeout_s * 1000),
             })
 
+        if self.__compression_type:
+            config.update({
+                'compression_type': self.__compression_type,
+            })
+
         if self.__topic_group_id:
             config.update({
                 'topic_group_id': self.__topic_group_id,
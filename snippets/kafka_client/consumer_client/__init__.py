@@ -1,24 +1,69 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import json
 import logging
 
 from kafka import KafkaConsumer
 
 from snippets.kafka_client import KafkaConfig
+from snippets.kafka_client.serializers import deserialize
 
 logger = logging.getLogger(__name__)
 
 
+def _decode(message):
+    return message._replace(value=deserialize(message.value, message.headers))
+
+
+def _decode_or_keep(message):
+    """Decode a consumed message, keeping its raw value when it cannot be decoded."""
+    try:
+        return _decode(message)
+    except Exception as e:
+        # Its position is already consumed, raising would lose it and the rest of its batch
+        logger.error(f"Unable to decode message {message.topic}-{message.partition}@{message.offset}, "
+                     f"keeping its raw value: {e}")
+        return message
+
+
+class DecodingKafkaConsumer(KafkaConsumer):
+    """
+    KafkaConsumer decoding values by their format header, when iterated and in poll().
+
+    value_deserializer only gets the value bytes, so decoding by header
+    happens on the records instead. Records which cannot be decoded, e.g. of
+    an unknown format, are logged and keep their raw bytes value.
+    """
+
+    def poll(self, *args, **kwargs):
+        # Iteration goes through poll() too, except with the legacy iterator
+        return {
+            partition: [_decode_or_keep(message) for message in messages]
+            for partition, messages in super().poll(*args, **kwargs).items()
+        }
+
+    def __next__(self):
+        message = super().__next__()
+        return _decode_or_keep(message) if self.config.get('legacy_iterator') else message
+
+
 class KafkaConsumerClient:
-    def __init__(self, config: KafkaConfig):
+    """
+    Consumes the configured topic.
+
+    Iterating or polling the consumer gives messages with their values
+    decoded by the format header set by KafkaProducerClient, so producers can
+    change serializer without reconfiguring consumers; values which cannot be
+    decoded stay bytes. With raw=True values are left as bytes, for decode()
+    to decode them later, e.g. in a worker.
+    """
+
+    def __init__(self, config: KafkaConfig, enable_auto_commit=True, raw=False):
         self.config = config.get_config()
         consumer_config = {
             'bootstrap_servers': self.config['bootstrap_servers'],
-            'value_deserializer': lambda x: json.loads(x.decode('utf-8')),
             'auto_offset_reset': 'earliest',
-            'enable_auto_commit': True,
+            'enable_auto_commit': enable_auto_commit,
             'group_id': self.config['topic_group_id']
         }
         server_configs = {
@@ -28,18 +73,24 @@ class KafkaConsumerClient:
             'sasl_plain_password': self.config.get('sasl_plain_password'),
             'ssl_check_hostname': self.config.get('ssl_check_hostname'),
             'ssl_cafile': self.config.get('ssl_cafile'),
-            'acks': self.config.get('acks'),
-            'compression_type': self.config.get('compression_type'),
-            'batch_size': self.config.get('batch_size'),
-            'buffer_memory': self.config.get('buffer_memory'),
-            'max_request_size': self.config.get('max_request_size'),
             'client_id': self.config.get('client_id'),
             'api_version': self.config.get('api_version'),
         }
         consumer_config.update({k: v for k, v in server_configs.items() if v is not None})
-        self.consumer = KafkaConsumer(**consumer_config)
+        self.raw = raw
+        self.consumer = (KafkaConsumer if raw else DecodingKafkaConsumer)(**consumer_config)
         self.consumer.subscribe([self.config['topic']])
 
+    @staticmethod
+    def decode(message):
+        """Return a message consumed with raw=True with its value decoded, raising when it cannot be."""
+        return _decode(message)
+
+    def messages(self):
+        """Yield consumed messages with decoded values, raw ones where decoding fails."""
+        for message in self.consumer:
+            yield _decode_or_keep(message) if self.raw else message
+
     def close(self):
         if self.consumer:
             self.consumer.close()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from kafka import ConsumerRebalanceListener
+from kafka.structs import OffsetAndMetadata
+
+from snippets.kafka_client.consumer_client import KafkaConsumerClient
+from snippets.kafka_client.serializers import deserialize
+
+logger = logging.getLogger(__name__)
+
+# Records returned by one poll()
+MAX_POLL_RECORDS = 500
+# Messages handed to workers and not yet processed, above which every partition is paused
+MAX_IN_FLIGHT = 10000
+POLL_TIMEOUT_MS = 500
+
+EXECUTOR_THREAD = 'thread'
+EXECUTOR_PROCESS = 'process'
+
+
+def _offset(offset: int) -> OffsetAndMetadata:
+    try:
+        return OffsetAndMetadata(offset, '', -1)
+    except TypeError:
+        # kafka-python before 2.1 has no leader epoch
+        return OffsetAndMetadata(offset, '')
+
+
+def _process(handler, messages):
+    """Decode and handle the messages of one partition in order; runs in a worker."""
+    for message in messages:
+        handler(message._replace(value=deserialize(message.value, message.headers)))
+    return len(messages)
+
+
+class BatchConsumer(ConsumerRebalanceListener):
+    """
+    Consumes a KafkaConsumerClient in batches with a pool of workers.
+
+    Every poll() returns records of several partitions; the records of each
+    partition go to a worker as one task and the partition is paused until
+    the task is done, so partitions are processed in parallel and the
+    messages of a partition in order. The offsets of a partition are
+    committed once its task succeeded, never before, so nothing is lost when
+    the process dies; messages may be processed again after a restart.
+
+    handler(message) is called with every message, its value decoded by
+    the worker, so the client is created with raw=True. With the process
+    executor it must be picklable, i.e. a module level function.
+    While more than max_in_flight messages are being processed, all
+    partitions are paused while polling goes on, so the group membership is
+    kept. A failing handler stops the consumer with its error, after the
+    offsets of the tasks which succeeded are committed.
+    """
+
+    def __init__(
+            self,
+            client: KafkaConsumerClient,
+            handler,
+            workers: int = 4,
+            executor: str = EXECUTOR_THREAD,
+            max_poll_records: int = MAX_POLL_RECORDS,
+            max_in_flight: int = MAX_IN_FLIGHT,
+            poll_timeout_ms: int = POLL_TIMEOUT_MS
+    ):
+        if client.consumer.config['enable_auto_commit']:
+            raise ValueError('BatchConsumer commits offsets itself, create the client with enable_auto_commit=False')
+        if not client.raw:
+            raise ValueError('BatchConsumer decodes values in its workers, create the client with raw=True')
+        if executor not in (EXECUTOR_THREAD, EXECUTOR_PROCESS):
+            raise ValueError(f"Unknown executor {executor!r}")
+        self.client = client
+        self.consumer = client.consumer
+        self.handler = handler
+        self.workers = workers
+        self.executor = executor
+        self.max_poll_records = max_poll_records
+        self.max_in_flight = max_in_flight
+        self.poll_timeout_ms = poll_timeout_ms
+        self.processed = 0
+        self.commits = 0
+        self.in_flight = 0
+        # future -> (partition, offset to commit, message count)
+        self._tasks = {}
+        self._paused_all = False
+        # First handler error, raised by run(); tasks also complete in the rebalance listener, which cannot raise
+        self._error = None
+        self._stop = threading.Event()
+        self._pool = None
+        self.consumer.subscribe([client.config['topic']], listener=self)
+
+    def _submit(self, partition, messages):
+        future = self._pool.submit(_process, self.handler, messages)
+        self._tasks[future] = (partition, messages[-1].offset + 1, len(messages))
+        self.in_flight += len(messages)
+        self.consumer.pause(partition)
+
+    def _complete(self, futures):
+        """Commit the offsets of finished tasks and resume their partitions; keep the first error for run()."""
+        offsets = {}
+        for future in futures:
+            partition, offset, count = self._tasks.pop(future)
+            self.in_flight -= count
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Processing {count} messages of {partition} failed: {e}")
+                self._error = self._error or e
+                continue
+            self.processed += count
+            offsets[partition] = _offset(offset)
+            if not self._paused_all and partition in self.consumer.assignment():
+                self.consumer.resume(partition)
+        if offsets:
+            self.consumer.commit(offsets)
+            self.commits += 1
+
+    def _wait(self, partitions=None, timeout=None):
+        """Wait for the tasks of the partitions, or all tasks, to finish."""
+        futures = [future for future, (partition, _, _) in self._tasks.items()
+                   if partitions is None or partition in partitions]
+        if futures:
+            done, _ = wait(futures, timeout=timeout)
+            self._complete(done)
+
+    def _backpressure(self):
+        assignment = self.consumer.assignment()
+        if self.in_flight >= self.max_in_flight and not self._paused_all:
+            self.consumer.pause(*assignment)
+            self._paused_all = True
+        elif self.in_flight < self.max_in_flight and self._paused_all:
+            busy = {partition for partition, _, _ in self._tasks.values()}
+            self.consumer.resume(*(assignment - busy))
+            self._paused_all = False
+
+    def on_partitions_revoked(self, revoked):
+        # Finish and commit what was handed out before another member takes the partitions
+        self._wait(set(revoked))
+
+    def on_partitions_assigned(self, assigned):
+        pass
+
+    def run(self):
+        """Consume until stop() is called or a handler fails."""
+        pool_class = ProcessPoolExecutor if self.executor == EXECUTOR_PROCESS else ThreadPoolExecutor
+        start_time = time.monotonic()
+        with pool_class(max_workers=self.workers) as self._pool:
+            try:
+                while not self._stop.is_set() and self._error is None:
+                    # With tasks running, wait on them rather than in poll() on paused partitions
+                    batches = self.consumer.poll(timeout_ms=0 if self._tasks else self.poll_timeout_ms,
+                                                 max_records=self.max_poll_records)
+                    if self._error is not None:
+                        # A task completed in on_partitions_revoked failed, the polled messages are left uncommitted
+                        break
+                    for partition, messages in batches.items():
+                        if messages:
+                            self._submit(partition, messages)
+                    if self._tasks and not batches:
+                        wait(self._tasks, timeout=self.poll_timeout_ms / 1000, return_when=FIRST_COMPLETED)
+                    done = [future for future in self._tasks if future.done()]
+                    if done:
+                        self._complete(done)
+                    self._backpressure()
+            finally:
+                self._wait()
+        elapsed = time.monotonic() - start_time
+        logger.info(f"Processed {self.processed} messages in {elapsed:.1f}s "
+                    f"({self.processed / max(elapsed, 1e-3):.0f}/s), {self.commits} commits")
+        if self._error is not None:
+            raise self._error
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import logging
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from kafka import KafkaAdminClient, KafkaConsumer, TopicPartition
+from kafka.structs import OffsetAndMetadata
+
+from snippets.kafka_client import KafkaConfig
+
+logger = logging.getLogger(__name__)
+
+# Group states in which the broker accepts offsets from outside the group
+INACTIVE_STATES = ('Empty', 'Dead')
+# Timeout of every broker request, so a reset fails fast instead of hanging
+REQUEST_TIMEOUT_MS = 5000
+# Settings of the consumers committing for a group. They never join it, but
+# kafka-python requires the request timeout above the session timeout and the
+# session timeout above the heartbeat interval
+GROUP_CONSUMER_CONFIG = {'session_timeout_ms': 4000, 'heartbeat_interval_ms': 1000}
+
+_CONNECTION_KEYS = ('security_protocol', 'sasl_mechanism', 'sasl_plain_username', 'sasl_plain_password',
+                    'ssl_check_hostname', 'ssl_cafile', 'client_id', 'api_version')
+
+
+def _connection_config(config: KafkaConfig) -> dict:
+    """Settings of config shared by consumers and the admin client."""
+    settings = config.get_config()
+    connection = {'bootstrap_servers': settings['bootstrap_servers'], 'request_timeout_ms': REQUEST_TIMEOUT_MS}
+    connection.update({key: settings[key] for key in _CONNECTION_KEYS if settings.get(key) is not None})
+    return connection
+
+
+def _offset(offset: int) -> OffsetAndMetadata:
+    try:
+        return OffsetAndMetadata(offset, '', -1)
+    except TypeError:
+        # kafka-python before 2.1 has no leader epoch
+        return OffsetAndMetadata(offset, '')
+
+
+def offsets_at(consumer: KafkaConsumer, topics: List[str], moment: datetime) -> Dict[TopicPartition, int]:
+    """
+    The offset of the first message at or after a time in every partition of the topics.
+
+    Partitions without such a message get their end offset, as
+    kafka-consumer-groups.sh --to-datetime does.
+    """
+    partitions = []
+    for topic in topics:
+        numbers = consumer.partitions_for_topic(topic)
+        if not numbers:
+            raise ValueError(f"Unknown topic {topic!r}")
+        partitions.extend(TopicPartition(topic, number) for number in sorted(numbers))
+    timestamp_ms = int(moment.timestamp() * 1000)
+    found = consumer.offsets_for_times({partition: timestamp_ms for partition in partitions})
+    end_offsets = consumer.end_offsets(partitions)
+    return {
+        partition: found[partition].offset if found[partition] is not None else end_offsets[partition]
+        for partition in partitions
+    }
+
+
+def reset_offsets(
+        config: KafkaConfig,
+        groups: List[str],
+        topics: List[str],
+        moment: datetime,
+        dry_run: bool = False
+) -> Dict[str, Dict[TopicPartition, Tuple[int, int]]]:
+    """
+    Reset the committed offsets of consumer groups on topics to a time, without the Kafka command line tools.
+
+    The offsets are looked up once for all topics and committed for every
+    group, the broker doing in one request each what
+    kafka-consumer-groups.sh --reset-offsets --to-datetime does after
+    starting a JVM. A naive moment is local time. Returns the (current, new)
+    offset of every partition by group, current None where the group has no
+    offset; with dry_run nothing is committed. Like the command line tool,
+    it refuses to reset groups with active members, which would overwrite
+    the new offsets; all groups are checked before any is reset.
+    """
+    connection = _connection_config(config)
+    admin = KafkaAdminClient(**connection)
+    try:
+        states = {info.group: info.state for info in admin.describe_consumer_groups(groups)}
+        active = [group for group in groups if states.get(group) not in INACTIVE_STATES]
+        if active and not dry_run:
+            raise ValueError(f"Groups {', '.join(active)} have active members, stop their consumers first")
+        for group in active:
+            logger.warning(f"Group {group} is {states.get(group)}, its offsets could not be reset now")
+        current = {group: admin.list_consumer_group_offsets(group) for group in groups}
+    finally:
+        admin.close()
+
+    lookup = KafkaConsumer(enable_auto_commit=False, group_id=None, **connection)
+    try:
+        new_offsets = offsets_at(lookup, topics, moment)
+    finally:
+        lookup.close()
+
+    result = {}
+    for group in groups:
+        committed = current[group]
+        result[group] = {
+            partition: (committed[partition].offset if partition in committed else None, offset)
+            for partition, offset in new_offsets.items()
+        }
+        if dry_run:
+            continue
+        consumer = KafkaConsumer(enable_auto_commit=False, group_id=group, **GROUP_CONSUMER_CONFIG, **connection)
+        try:
+            consumer.assign(list(new_offsets))
+            consumer.commit({partition: _offset(offset) for partition, offset in new_offsets.items()})
+        finally:
+            consumer.close()
+        logger.info(f"Reset {len(new_offsets)} partitions of group {group} to {moment.isoformat()}")
+    return result
+
+
+def format_resets(resets: Dict[str, Dict[TopicPartition, Tuple[int, int]]]) -> str:
+    """A table of the resets like the one of kafka-consumer-groups.sh."""
+    lines = [f"{'GROUP':<30} {'TOPIC':<30} {'PARTITION':>9} {'CURRENT-OFFSET':>15} {'NEW-OFFSET':>15}"]
+    for group, partitions in resets.items():
+        for partition, (current, new) in sorted(partitions.items()):
+            lines.append(f"{group:<30} {partition.topic:<30} {partition.partition:>9} "
+                         f"{'-' if current is None else current:>15} {new:>15}")
+    return '\n'.join(lines)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Reset consumer group offsets to a date and time')
+    parser.add_argument('--bootstrap-servers', required=True, help='Kafka bootstrap servers')
+    parser.add_argument('--group', action='append', required=True, help='Consumer group, may be repeated')
+    parser.add_argument('--topic', action='append', required=True, help='Topic, may be repeated')
+    parser.add_argument('--to-datetime', required=True, type=datetime.fromisoformat,
+                        help='ISO date and time, local unless it has an offset, e.g. 2024-05-01T00:00:00')
+    parser.add_argument('--username', help='SASL username')
+    parser.add_argument('--password', help='SASL password')
+    parser.add_argument('--cafile', help='CA certificate file for SSL')
+    parser.add_argument('--dry-run', action='store_true', help='Show the new offsets without committing them')
+    args = parser.parse_args()
+    config = KafkaConfig(bootstrap_servers=args.bootstrap_servers, topic=args.topic[0], username=args.username,
+                         password=args.password, cafile=args.cafile)
+    print(format_resets(reset_offsets(config, args.group, args.topic, args.to_datetime, args.dry_run)))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,23 +2,52 @@
 # -*- coding: utf-8 -*-
 
 
-import json
 import logging
+import threading
+import time
 
 from kafka import KafkaProducer
+from kafka.errors import KafkaError
 
 from snippets.kafka_client import KafkaConfig
-from snippets.utils.decorators import retry_with_backoff
+from snippets.kafka_client.serializers import FORMAT_HEADER, check_compression, get_serializer
+from snippets.utils.decorators import circuit_breaker, get_circuit_breaker, retry_with_backoff
 
 logger = logging.getLogger(__name__)
 
+# Unacknowledged messages after which send() waits for the broker
+MAX_PENDING_MESSAGES = 50000
+# Seconds after which send() waits for the messages sent since the last flush
+FLUSH_INTERVAL = 5.0
+
 
 class KafkaProducerClient:
-    def __init__(self, config: KafkaConfig):
+    """
+    Sends messages to the configured topic.
+
+    send_message() waits for every message to be acknowledged. send() and
+    send_many() only queue messages, which the producer batches per linger_ms
+    and batch_size, and report each delivery through the returned future and
+    the optional callback. They flush only once max_pending messages are
+    unacknowledged, flush_interval seconds after the last flush, or on
+    flush() and close().
+    """
+
+    def __init__(self, config: KafkaConfig, max_pending=MAX_PENDING_MESSAGES, flush_interval=FLUSH_INTERVAL):
         self.config = config.get_config()
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.pending = 0
+        self.delivered = 0
+        self.failed = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._breaker = get_circuit_breaker(f"kafka:{self.config['bootstrap_servers']}")
+        self.serializer = get_serializer(self.config['serializer'])
+        self.headers = [(FORMAT_HEADER, self.serializer.format.encode('utf-8'))]
         producer_config = {
             'bootstrap_servers': self.config['bootstrap_servers'],
-            'value_serializer': lambda v: json.dumps(v).encode('utf-8'),
+            'value_serializer': self.serializer.dumps,
             'retries': self.config.get('retries'),
             'linger_ms': self.config.get('linger_ms'),
         }
@@ -30,7 +59,7 @@ class KafkaProducerClient:
             'ssl_check_hostname': self.config.get('ssl_check_hostname'),
             'ssl_cafile': self.config.get('ssl_cafile'),
             'acks': self.config.get('acks'),
-            'compression_type': self.config.get('compression_type'),
+            'compression_type': check_compression(self.config.get('compression_type')),
             'batch_size': self.config.get('batch_size'),
             'buffer_memory': self.config.get('buffer_memory'),
             'max_request_size': self.config.get('max_request_size'),
@@ -40,16 +69,75 @@ class KafkaProducerClient:
         producer_config.update({k: v for k, v in server_configs.items() if v is not None})
         self.producer = KafkaProducer(**producer_config)
 
-    @retry_with_backoff()
+    @retry_with_backoff(exceptions=(KafkaError,))
+    @circuit_breaker(lambda self, message: f"kafka:{self.config['bootstrap_servers']}")
     def send_message(self, message):
         try:
-            self.producer.send(self.config['topic'], message)
+            future = self.producer.send(self.config['topic'], message, headers=self.headers)
             self.producer.flush()
+            # Raises the delivery error, flush() alone does not
+            future.get(timeout=0)
             logger.info("Message sent to Kafka")
-        except Exception as e:
+        except KafkaError as e:
             logger.error(f"Failed to send message: {e}")
+            raise
+
+    def _delivered(self, callback, metadata):
+        with self._lock:
+            self.pending -= 1
+            self.delivered += 1
+        self._breaker.record_success()
+        if callback is not None:
+            callback(metadata, None)
+
+    def _failed(self, callback, error):
+        with self._lock:
+            self.pending -= 1
+            self.failed += 1
+        self._breaker.record_failure()
+        logger.error(f"Failed to deliver message: {error}")
+        if callback is not None:
+            callback(None, error)
+
+    def send(self, message, key=None, callback=None):
+        """
+        Queue a message and return its delivery future.
+
+        callback(metadata, error) is called from the producer's I/O thread once
+        the message is acknowledged, with error set when it could not be
+        delivered. Raises CircuitOpenError while the broker keeps failing.
+        """
+        self._breaker.before_call()
+        try:
+            future = self.producer.send(self.config['topic'], message, key=key, headers=self.headers)
+        except KafkaError:
+            # e.g. KafkaTimeoutError without metadata; delivery callbacks record the outcome of everything queued
+            self._breaker.record_failure()
+            raise
+        except BaseException:
+            # e.g. a value the serializer rejects, which says nothing about the broker
+            self._breaker.release()
+            raise
+        with self._lock:
+            self.pending += 1
+        future.add_callback(self._delivered, callback)
+        future.add_errback(self._failed, callback)
+        if self.pending >= self.max_pending or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+        return future
+
+    def send_many(self, messages, callback=None):
+        """Queue every message of an iterable and return their delivery futures."""
+        return [self.send(message, callback=callback) for message in messages]
+
+    def flush(self, timeout=None):
+        """Wait until every queued message is acknowledged or failed."""
+        self.producer.flush(timeout)
+        self._last_flush = time.monotonic()
 
     def close(self):
         if self.producer:
+            self.flush()
+            logger.info(f"Kafka producer delivered {self.delivered} messages, {self.failed} failed")
             self.producer.close()
             logger.info("Kafka producer closed")
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+from typing import Iterable, Optional, Tuple
+
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+# Meter and NIC epochs are stored as naive IST datetimes
+IST_OFFSET = pl.duration(hours=5, minutes=30)
+LOCAL_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+PAYLOAD_COLUMNS = ['nic_time', 'meter_time', 'rtc_drift']
+
+
+def _to_integer(text: pl.Expr) -> pl.Expr:
+    return text.str.strip_chars().cast(pl.Int64, strict=False)
+
+
+def epoch_to_ist(seconds: pl.Expr) -> pl.Expr:
+    """Convert Unix timestamps to naive IST datetimes."""
+    return pl.from_epoch(seconds, time_unit='s') + IST_OFFSET
+
+
+def utc_to_local(times: pl.Expr, dtype: pl.DataType, local_tz: str) -> pl.Expr:
+    """
+    Convert UTC datetimes or ISO 8601 strings to 'YYYY-MM-DD HH:MM:SS' strings of a timezone.
+
+    Only 'YYYY-MM-DD HH:MM:SS[.f]' strings, with a T or a trailing Z or not,
+    are parsed here; other strings become null, see isoparse_to_local.
+    """
+    if isinstance(dtype, pl.Datetime):
+        utc = times.dt.replace_time_zone('UTC') if dtype.time_zone is None else times.dt.convert_time_zone('UTC')
+    else:
+        text = times.cast(pl.Utf8).str.strip_chars().str.replace('T', ' ', literal=True).str.strip_chars_end('Z')
+        utc = text.str.to_datetime('%Y-%m-%d %H:%M:%S%.f', time_unit='us', time_zone='UTC', strict=False)
+    return utc.dt.convert_time_zone(local_tz).dt.strftime(LOCAL_TIME_FORMAT)
+
+
+def isoparse_to_local(value, local_tz: str) -> Optional[str]:
+    """
+    Convert one ISO 8601 string to a 'YYYY-MM-DD HH:MM:SS' string of a timezone, None if it is not one.
+
+    Like the former per row conversion, any offset of the
+    string is dropped and its time taken as UTC.
+    """
+    from dateutil import parser, tz
+    try:
+        utc = parser.isoparse(value).replace(tzinfo=tz.UTC)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return utc.astimezone(tz.gettz(local_tz)).strftime(LOCAL_TIME_FORMAT)
+
+
+def parse_rtc_payload(payload: pl.Series) -> pl.DataFrame:
+    """
+    Split RTC payloads into nic_time, meter_time and rtc_drift columns.
+
+    Payloads are "nic_epoch,meter_epoch,drift"; payloads which are not are
+    read as fixed width fields, the NIC epoch in the first 10 characters, the
+    meter epoch in the next 10 and the drift after them. Payloads matching
+    neither layout give nulls.
+    """
+    # Each stage is materialised, chained expressions would split the payloads once per field
+    fields = payload.cast(pl.Utf8).to_frame('text').with_columns(pl.col('text').str.splitn(',', 4).alias('csv'))
+    fields = fields.select(
+        *(_to_integer(pl.col('csv').struct.field(f"field_{i}")).alias(f"csv_{i}") for i in range(3)),
+        _to_integer(pl.col('text').str.slice(0, 10)).alias('fixed_0'),
+        _to_integer(pl.col('text').str.slice(10, 10)).alias('fixed_1'),
+        _to_integer(pl.col('text').str.slice(20)).alias('fixed_2'),
+    )
+    is_csv = pl.all_horizontal([pl.col(f"csv_{i}").is_not_null() for i in range(3)])
+    nic, meter, drift = (pl.when(is_csv).then(pl.col(f"csv_{i}")).otherwise(pl.col(f"fixed_{i}")) for i in range(3))
+    return fields.select(
+        epoch_to_ist(nic).alias('nic_time'),
+        epoch_to_ist(meter).alias('meter_time'),
+        drift.alias('rtc_drift'),
+    )
+
+
+def parse_rtc_events(
+        frame: pl.DataFrame,
+        payload_column: str,
+        utc_columns: Iterable[str] = (),
+        local_tz: Optional[str] = None
+) -> Tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    Parse a frame of RTC events with whole column operations.
+
+    The payload column is split into nic_time, meter_time and rtc_drift
+    columns and each of utc_columns is replaced by its local time string.
+
+    Args:
+        frame: RTC events, e.g. as read by polars.read_excel.
+        payload_column: Column holding the RTC payload.
+        utc_columns: Columns of UTC timestamps converted to local time.
+        local_tz: IANA name of the local timezone, defaults to the one of the system.
+
+    Returns:
+        The parsed rows, and the original rows which could not be parsed with
+        an `error` column saying why.
+    """
+    if local_tz is None:
+        from tzlocal import get_localzone_name
+        local_tz = get_localzone_name()
+    utc_columns = list(utc_columns)
+
+    parsed = pl.concat([frame.drop([column for column in PAYLOAD_COLUMNS if column in frame.columns]),
+                        parse_rtc_payload(frame[payload_column])], how='horizontal')
+    parsed = parsed.with_columns(
+        *(utc_to_local(pl.col(column), frame.schema[column], local_tz) for column in utc_columns),
+    )
+    for column in utc_columns:
+        # The few timestamps in other ISO 8601 forms, e.g. with an offset or without seconds, are parsed one by one
+        missed = (parsed[column].is_null() & frame[column].is_not_null()).arg_true()
+        if len(missed):
+            fallback = [isoparse_to_local(value, local_tz) for value in frame[column].gather(missed)]
+            parsed = parsed.with_columns(parsed[column].scatter(missed, pl.Series(fallback, dtype=pl.Utf8)))
+    error = pl.when(pl.any_horizontal([pl.col(column).is_null() for column in PAYLOAD_COLUMNS])) \
+        .then(pl.lit(f"unparsable payload in column {payload_column}"))
+    for column in utc_columns:
+        # Nulls stay null, like they did with the per row conversion
+        error = error.when(pl.col(column).is_null() & frame[column].is_not_null()) \
+            .then(pl.lit(f"unparsable timestamp in column {column}"))
+    errors = parsed.select(error.otherwise(None))[:, 0]
+
+    failed = errors.is_not_null()
+    exceptions = frame.filter(failed).with_columns(errors.filter(failed).alias('error'))
+    if len(exceptions):
+        logger.warning(f"{len(exceptions)} of {len(frame)} RTC events could not be parsed")
+    return parsed.filter(~failed), exceptions
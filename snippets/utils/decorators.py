@@ -1,69 +1,375 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import functools
+import asyncio
+import inspect
 import logging
-import sys
+import random
+import threading
 import time
 from functools import wraps
 
+from snippets.utils import metrics
+
 logger = logging.getLogger(__name__)
 
 
-def retry_with_backoff(max_retries=5, delay=5, backoff=1, exceptions=(Exception,)):
+class RetryError(Exception):
+    """Raised when a retried call failed on every attempt, ran out of time or of retry budget."""
+
+    def __init__(self, message, attempts, last_exception):
+        super().__init__(message)
+        self.attempts = attempts
+        self.last_exception = last_exception
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit breaker is open."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit {name} is open, retry in {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class RetryBudget:
+    """
+    Caps retries to a share of the calls made, shared by every call using it.
+
+    Each call deposits `ratio` tokens and each retry withdraws one, and at
+    least min_per_second retries per second are always allowed. When a
+    dependency is down, callers give up instead of multiplying its load.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=1.0, max_tokens=10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, tokens):
+        now = time.monotonic()
+        self._tokens = min(self.max_tokens, self._tokens + tokens + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill(self.ratio)
+
+    def withdraw(self):
+        """Take a token for a retry, False when the budget is spent."""
+        with self._lock:
+            self._refill(0)
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class _Attempts:
+    """Backoff state of one call."""
+
+    def __init__(self, name, attempts, delay, backoff, max_delay, jitter, deadline, budget):
+        self.name = name
+        self.attempts = attempts
+        self.delay = delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = None if deadline is None else time.monotonic() + deadline
+        self.budget = budget
+        self.attempt = 0
+        if budget is not None:
+            budget.deposit()
+
+    def next_delay(self, error):
+        """Return the seconds to wait before the next attempt, or raise RetryError."""
+        self.attempt += 1
+        if self.attempt >= self.attempts:
+            raise RetryError(f"{self.name} failed {self.attempt} times: {error}", self.attempt, error) from error
+        delay = min(self.max_delay, self.delay * self.backoff ** (self.attempt - 1))
+        if self.jitter:
+            # Full jitter, so callers failing together do not retry together
+            delay = random.uniform(0, delay)
+        if self.deadline is not None and time.monotonic() + delay > self.deadline:
+            raise RetryError(f"{self.name} failed {self.attempt} times, out of time: {error}",
+                             self.attempt, error) from error
+        if self.budget is not None and not self.budget.withdraw():
+            raise RetryError(f"{self.name} failed {self.attempt} times, out of retry budget: {error}",
+                             self.attempt, error) from error
+        logger.warning(f"{self.name} failed: {error}, retrying in {delay:.2f}s ({self.attempt}/{self.attempts})")
+        return delay
+
+
+def retry(attempts=5, delay=1.0, backoff=2.0, max_delay=60.0, jitter=True, deadline=None,
+          exceptions=(Exception,), budget=None):
+    """
+    Retry a function or coroutine function with exponential backoff.
+
+    The delay starts at `delay` seconds for every call, is multiplied by
+    `backoff` after each failure up to max_delay and, with jitter, a random
+    part of it is waited. Coroutine functions wait with asyncio.sleep, so the
+    event loop keeps running. Retries stop after `attempts` attempts, when
+    the next one would start after `deadline` seconds from the first one, or
+    when the shared RetryBudget is spent, raising RetryError. Exceptions not
+    in `exceptions`, and CircuitOpenError, are raised at once.
+    """
+
     def decorator(func):
+        def attempts_of_call():
+            return _Attempts(func.__qualname__, attempts, delay, backoff, max_delay, jitter, deadline, budget)
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                state = attempts_of_call()
+                while True:
+                    try:
+                        return await func(*args, **kwargs)
+                    except CircuitOpenError:
+                        raise
+                    except exceptions as e:
+                        wait = state.next_delay(e)
+                    await asyncio.sleep(wait)
+
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            current_delay = delay
-            retries = 0
-            while retries < max_retries:
+            state = attempts_of_call()
+            while True:
                 try:
                     return func(*args, **kwargs)
+                except CircuitOpenError:
+                    raise
                 except exceptions as e:
-                    retries += 1
-                    if retries == max_retries:
-                        logger.error(f"Error: {e}, reached max retries ({max_retries}). Exiting with status 0.")
-                        sys.exit(0)
-                    logger.error(f"Error: {e}, retrying in {current_delay} seconds... ({retries}/{max_retries})")
-                    time.sleep(current_delay)
-                    current_delay *= backoff
+                    wait = state.next_delay(e)
+                time.sleep(wait)
 
         return wrapper
 
     return decorator
 
 
-# Example decorator implementation to handle instance methods
-def retry_with_backoff_func(retries=3, delay=1, backoff=2):
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_OPEN = 'open'
+CIRCUIT_HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Fails calls to a dependency fast once it keeps failing.
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    raise CircuitOpenError without being made. After reset_timeout seconds
+    it is half open, and up to half_open_max_calls trial calls go through:
+    a success closes the circuit, a failure opens it again. Every admitted
+    call must end in record_success(), record_failure() or release().
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, half_open_max_calls=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.transitions = {CIRCUIT_CLOSED: 0, CIRCUIT_OPEN: 0, CIRCUIT_HALF_OPEN: 0}
+        self.listeners = []
+        self._opened_at = 0.0
+        self._trials = 0
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        """Change state; called with the lock held, returns the listener calls to make."""
+        previous, self.state = self.state, state
+        self.transitions[state] += 1
+        if state == CIRCUIT_OPEN:
+            self._opened_at = time.monotonic()
+            logger.error(f"Circuit {self.name} opened after {self.consecutive_failures} failures")
+        else:
+            logger.warning(f"Circuit {self.name} is {state}")
+        return [(listener, previous, state) for listener in self.listeners]
+
+    @staticmethod
+    def _notify(calls, breaker):
+        for listener, previous, state in calls:
+            listener(breaker, previous, state)
+
+    def before_call(self):
+        """Admit a call or raise CircuitOpenError."""
+        calls = []
+        with self._lock:
+            if self.state == CIRCUIT_OPEN:
+                retry_after = self._opened_at + self.reset_timeout - time.monotonic()
+                if retry_after > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, retry_after)
+                calls = self._transition(CIRCUIT_HALF_OPEN)
+                self._trials = 0
+            if self.state == CIRCUIT_HALF_OPEN:
+                if self._trials >= self.half_open_max_calls:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, 0.0)
+                self._trials += 1
+        self._notify(calls, self)
+
+    def release(self):
+        """End an admitted call without an outcome, e.g. it raised an error not counted as a failure."""
+        with self._lock:
+            if self.state == CIRCUIT_HALF_OPEN and self._trials > 0:
+                self._trials -= 1
+
+    def record_success(self):
+        calls = []
+        with self._lock:
+            self.successes += 1
+            self.consecutive_failures = 0
+            if self.state != CIRCUIT_CLOSED:
+                calls = self._transition(CIRCUIT_CLOSED)
+        self._notify(calls, self)
+
+    def record_failure(self):
+        calls = []
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.state == CIRCUIT_HALF_OPEN or (
+                    self.state == CIRCUIT_CLOSED and self.consecutive_failures >= self.failure_threshold):
+                calls = self._transition(CIRCUIT_OPEN)
+        self._notify(calls, self)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'successes': self.successes,
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'opened': self.transitions[CIRCUIT_OPEN],
+            }
+
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name, **options) -> CircuitBreaker:
+    """Return the circuit breaker of a target, created with options on first use."""
+    with _circuit_breakers_lock:
+        if name not in _circuit_breakers:
+            _circuit_breakers[name] = CircuitBreaker(name, **options)
+        return _circuit_breakers[name]
+
+
+def circuit_breaker_metrics() -> dict:
+    """Snapshots of all circuit breakers by target."""
+    with _circuit_breakers_lock:
+        breakers = list(_circuit_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
+
+
+def circuit_breaker(target, failure_threshold=5, reset_timeout=30.0, half_open_max_calls=1,
+                    exceptions=(Exception,)):
+    """
+    Guard a function or coroutine function with the circuit breaker of a target.
+
+    target is the breaker name, or a function of the call arguments returning
+    it, e.g. the host of the instance a method is called on. All call sites
+    of a target share its breaker. Only `exceptions` count as failures;
+    other errors neither open nor close the circuit. Put
+    it below retry(), which does not retry CircuitOpenError, so retries stop
+    as soon as the circuit opens.
+    """
+    options = {
+        'failure_threshold': failure_threshold,
+        'reset_timeout': reset_timeout,
+        'half_open_max_calls': half_open_max_calls,
+    }
+
     def decorator(func):
-        @functools.wraps(func)
-        def wrapper(*args, **kwargs):
-            nonlocal delay
-            attempt = 0
-            while attempt < retries:
+        def breaker_of(args, kwargs):
+            return get_circuit_breaker(target(*args, **kwargs) if callable(target) else target, **options)
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                breaker = breaker_of(args, kwargs)
+                breaker.before_call()
                 try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    logger.error(f"Attempt {attempt + 1} failed with exception: {e}")
-                    if attempt >= retries - 1:
-                        logger.error("Max retries reached. Failing.")
-                        raise
-                    attempt += 1
-                    time.sleep(delay)
-                    logger.info(f"Retrying after {delay} seconds...")
-                    delay *= backoff
+                    result = await func(*args, **kwargs)
+                except exceptions:
+                    breaker.record_failure()
+                    raise
+                except BaseException:
+                    # Neither success nor failure, e.g. cancellation; frees a half open trial
+                    breaker.release()
+                    raise
+                breaker.record_success()
+                return result
+
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            breaker = breaker_of(args, kwargs)
+            breaker.before_call()
+            try:
+                result = func(*args, **kwargs)
+            except exceptions:
+                breaker.record_failure()
+                raise
+            except BaseException:
+                # Neither success nor failure, e.g. KeyboardInterrupt; frees a half open trial
+                breaker.release()
+                raise
+            breaker.record_success()
+            return result
+
         return wrapper
+
     return decorator
 
 
-def measure_and_log_elapsed_time(f):
+def retry_with_backoff(max_retries=5, delay=5, backoff=1, exceptions=(Exception,)):
+    """retry() with the defaults of the original decorator; raises RetryError when out of retries."""
+    return retry(attempts=max_retries, delay=delay, backoff=backoff, max_delay=max(delay, 60.0),
+                 exceptions=exceptions)
+
+
+# Example decorator implementation to handle instance methods
+def retry_with_backoff_func(retries=3, delay=1, backoff=2):
+    """retry() with the defaults of the original decorator; raises RetryError when out of retries."""
+    return retry(attempts=retries, delay=delay, backoff=backoff)
+
+
+def measure_and_log_elapsed_time(f=None, **labels):
+    """
+    Record the latency of every call in the metrics registry and log it at debug level.
+
+    Calls are recorded in the function_latency_seconds histogram labelled
+    with the function name and the given labels; use it bare or as
+    @measure_and_log_elapsed_time(component='reports').
+    """
+    if f is None:
+        return lambda func: measure_and_log_elapsed_time(func, **labels)
+    histogram = metrics.registry.histogram('function_latency_seconds', function=f.__qualname__, **labels)
+
+    @wraps(f)
     def func(*args, **kwargs):
         start_time = time.monotonic()
-        result = f(*args, **kwargs)
-        end_time = time.monotonic()
-        elapsed_time = end_time - start_time
-        logger.debug('%s() took %.3fs', f.__name__, elapsed_time)
-        return result
+        try:
+            return f(*args, **kwargs)
+        finally:
+            elapsed_time = time.monotonic() - start_time
+            histogram.record(elapsed_time)
+            logger.debug('%s() took %.3fs', f.__name__, elapsed_time)
 
     return func
 
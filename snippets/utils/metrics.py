@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Values below 2 ** SUB_BUCKET_BITS microseconds get a bucket each, larger ones
+# keep their top SUB_BUCKET_BITS bits, a relative error of at most 1/32
+SUB_BUCKET_BITS = 6
+_HALF_SUB_BUCKETS = 1 << (SUB_BUCKET_BITS - 1)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _bucket(micros: int) -> int:
+    shift = micros.bit_length() - SUB_BUCKET_BITS
+    if shift <= 0:
+        return micros
+    return _HALF_SUB_BUCKETS * shift + (micros >> shift)
+
+
+def _bucket_upper(index: int) -> int:
+    """Highest value in microseconds of a bucket."""
+    if index < 2 * _HALF_SUB_BUCKETS:
+        return index
+    shift = index // _HALF_SUB_BUCKETS - 1
+    return ((index - _HALF_SUB_BUCKETS * shift + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    Latency histogram with log-linear buckets, like an HDR histogram.
+
+    Recording is a bit shift and a dict increment, and quantiles are within
+    about 3% of the exact value whatever the range of latencies.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        index = _bucket(max(int(seconds * 1e6), 0))
+        with self._lock:
+            self._buckets[index] = self._buckets.get(index, 0) + 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def snapshot(self) -> dict:
+        """Count, sum, max and the QUANTILES of the recorded latencies, in seconds."""
+        with self._lock:
+            buckets = sorted(self._buckets.items())
+            result = {'count': self.count, 'sum': self.total, 'max': self.max}
+        for q in QUANTILES:
+            rank = q * result['count']
+            seen = 0
+            value = 0.0
+            for index, count in buckets:
+                seen += count
+                if seen >= rank:
+                    value = _bucket_upper(index) / 1e6
+                    break
+            result[f"p{q * 100:g}"] = min(value, result['max'])
+        return result
+
+
+class MetricsRegistry:
+    """Latency histograms by metric name and labels, shared by all threads."""
+
+    def __init__(self):
+        self._histograms: Dict[Tuple[str, tuple], LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, **labels) -> LatencyHistogram:
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, LatencyHistogram())
+        return histogram
+
+    def observe(self, name: str, seconds: float, **labels):
+        self.histogram(name, **labels).record(seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Record the time spent in the with block."""
+        histogram = self.histogram(name, **labels)
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            histogram.record(time.monotonic() - start_time)
+
+    def snapshot(self) -> Dict[Tuple[str, tuple], dict]:
+        with self._lock:
+            histograms = list(self._histograms.items())
+        return {key: histogram.snapshot() for key, histogram in histograms}
+
+    def log(self, level=logging.INFO):
+        for (name, labels), stats in sorted(self.snapshot().items()):
+            label_text = ','.join(f"{key}={value}" for key, value in labels)
+            logger.log(level, f"{name}{{{label_text}}} count={stats['count']} p50={stats['p50']:.4f}s "
+                              f"p95={stats['p95']:.4f}s p99={stats['p99']:.4f}s max={stats['max']:.4f}s")
+
+    def prometheus_text(self) -> str:
+        """The histograms in the Prometheus text exposition format, as summaries."""
+        lines = []
+        typed = set()
+        for (name, labels), stats in sorted(self.snapshot().items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} summary")
+                typed.add(name)
+            label_text = ','.join(f'{key}="{value}"' for key, value in labels)
+            for q in QUANTILES:
+                quantile = f'quantile="{q}"'
+                lines.append(f"{name}{{{label_text + ',' if label_text else ''}{quantile}}} {stats[f'p{q * 100:g}']}")
+            suffix = f"{{{label_text}}}" if label_text else ''
+            lines.append(f"{name}_sum{suffix} {stats['sum']}")
+            lines.append(f"{name}_count{suffix} {stats['count']}")
+            lines.append(f"{name}_max{suffix} {stats['max']}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str):
+        """Write the Prometheus text atomically, e.g. for the node_exporter textfile collector."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as file_:
+            file_.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+
+registry = MetricsRegistry()
+
+
+class MetricsReporter:
+    """Dumps a registry every interval seconds to the log, or to a Prometheus text file when path is set."""
+
+    def __init__(self, interval: float = 60.0, path: Optional[str] = None, metrics: MetricsRegistry = registry):
+        self.interval = interval
+        self.path = path
+        self.metrics = metrics
+        self._stop = threading.Event()
+        self._thread = None
+
+    def report(self):
+        if self.path is not None:
+            self.metrics.write_prometheus(self.path)
+        else:
+            self.metrics.log()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.report()
+            except OSError as e:
+                logger.error(f"Unable to write metrics to {self.path}: {e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='metrics-reporter', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop reporting, after a last report."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.report()
@@ -1,16 +1,15 @@
-from datetime import timezone, timedelta, datetime
+from datetime import datetime
 
 import mysql
 import pandas as pd
+import polars as pl
 from openpyxl.reader.excel import load_workbook
 from openpyxl.styles import PatternFill, Font, Alignment
 from openpyxl.utils import get_column_letter
-import pytz
-from dateutil import parser
-from tzlocal import get_localzone
 
 from snippets.database_config import MySQLConfig
-from snippets.database_config.mysql_connector import MySQLConnector
+from snippets.database_config.mysql_connector import ER_NO_PARTITION_FOR_VALUE, MySQLConnector
+from snippets.rtc_events import parse_rtc_events
 
 # Global counters and master list
 count = 0
@@ -57,57 +56,25 @@ def format_sheet(sheet_name):
                 cell.fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
 
 
-def utc_to_local(utc_time_str):
-    # Check if the input is None
-    if utc_time_str is None:
-        return None
-    # Ensure the input is a string
-    if not isinstance(utc_time_str, str):
-        raise ValueError(f"Expected a string, got {type(utc_time_str)}")
-    # Parse the ISO 8601 format timestamp
-    try:
-        utc_time = parser.isoparse(utc_time_str)
-    except ValueError as e:
-        raise ValueError(f"Error parsing timestamp: {e}")
-    # Ensure the timestamp is localized to UTC
-    utc_time = utc_time.replace(tzinfo=pytz.UTC)
-    # Get the local system's time zone
-    local_tz = get_localzone()
-    # Convert to the local time zone
-    local_time = utc_time.astimezone(local_tz)
-    # Format the local time as a string
-    return local_time.strftime('%Y-%m-%d %H:%M:%S')
-
-
-def parse_timestamp(timestamp):
-    """Convert a Unix timestamp to a naive datetime object in IST."""
-    ist = timezone(timedelta(hours=5, minutes=30))  # IST is UTC+5:30
-    return datetime.fromtimestamp(int(timestamp), tz=ist).replace(tzinfo=None)
-
-
-def insert_rtc_event_data(self, cur, day_local, msn, node_id, meter_time, nic_time, rtc_drift, text_code,
-                          create_time, update_time, event_time):
-    rtc_event_data_query = """
-        INSERT INTO rtcsyncrep.rtc_messages (day_local, msn, node_id, meter_time, nic_time, rtc_drift, text_code, create_time, update_time, event_time)
-        VALUES (TO_DAYS(%s), %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON DUPLICATE KEY UPDATE
-            day_local = TO_DAYS(%s),
-            msn = %s, node_id = %s, meter_time = %s, nic_time = %s, rtc_drift = %s, text_code = %s,
-            create_time = %s, update_time = %s, event_time = %s;
+RTC_COLUMNS = ['day_local', 'msn', 'node_id', 'meter_time', 'nic_time', 'rtc_drift', 'text_code', 'create_time',
+               'update_time', 'event_time']
+
+
+def insert_rtc_event_data(rows):
+    """
+    Upsert the RTC event rows in multi-row batches, committing every 10000 rows.
+
+    Rows for which the table has no partition are skipped, like they were
+    row by row. Returns the number of rows upserted, None on another error,
+    the rows committed before it being logged.
     """
     try:
-        db_client.execute(rtc_event_data_query, (day_local, msn, node_id, meter_time, nic_time, rtc_drift, text_code,
-                                                 create_time, update_time, event_time,  # Values for INSERT
-                                                 day_local, msn, node_id, meter_time, nic_time, rtc_drift, text_code,
-                                                 # Values for UPDATE
-                                                 create_time, update_time, event_time))
+        return db_client.bulk_upsert('rtcsyncrep.rtc_messages', rows, columns=RTC_COLUMNS,
+                                     value_exprs={'day_local': 'TO_DAYS(%s)'}, batch_size=1000, commit_every=10000,
+                                     skip_errnos=(ER_NO_PARTITION_FOR_VALUE,))
     except mysql.connector.Error as err:
-        if err.errno == 1526:
-            self.logger.warning("Partition error: Table has no partition for the provided value.")
-        else:
-            self.logger.error(f"Error inserting data, MySQL Error: {err}")
-    except Exception as e:
-        self.logger.error(f"Error inserting data for MSN {msn}: {e}")
+        print(f"Error inserting data, MySQL Error: {err}")
+        return None
 
 
 def optimized_count_events(df, date_range):
@@ -139,55 +106,21 @@ def optimized_count_events(df, date_range):
 
 
 # Read the Excel file (ensure that headers are present in the file)
-df = pd.read_excel(r"C:\Users\MustafaMubashir\Downloads\rtc_data.xlsx")
-
-# Process rows and populate the master list
-for index, row in df.iterrows():
-    try:
-        # Access column 4 using its integer index (4 in this case)
-        params_str = row[4]  # Reference column 4 correctly
-        if pd.isnull(params_str):
-            raise ValueError("Column '4' is null.")
-
-        # Split the string in column '4' by commas and convert it into a list
-        parameters = params_str.split(',')
-        if len(parameters) < 3:
-            raise ValueError("Not enough parameters in column '4'.")
-        event_time = pd.to_datetime(row[7])
-        data = {
-            'day_local': row[1],  # Use integer index 1 for "day_local"
-            'msn': row[2],  # Use integer index 2 for "msn"
-            'node_id': row[3],  # Use integer index 3 for "node_id"
-            'meter_time': parse_timestamp(parameters[1]),
-            'nic_time': parse_timestamp(parameters[0]),
-            'rtc_drift': int(parameters[2]),
-            'text_code': row[5],  # Use integer index 5 for "text_code"
-            'create_time': row[6],  # Use integer index 6 for "create_time"
-            'update_time': row[7],  # Use integer index 7 for "update_time"
-            'event_time': row[8],  # Ensure event_time is in datetime format
-        }
-        insert_rtc_event_data(cursor, day_local=data['day_local'], msn=data['msn'],
-                              node_id=data['node_id'], meter_time=data['meter_time'],
-                              nic_time=data['nic_time'],
-                              rtc_drift=data['rtc_drift'], text_code=data['text_code'],
-                              create_time=utc_to_local(data['create_time']),
-                              update_time=utc_to_local(data['update_time']),
-                              event_time=utc_to_local(data['event_time']))
-    except Exception as e:
-        exception_data = {
-            'day_local': row[1],  # Use integer index 1 for "day_local"
-            'msn': row[2],  # Use integer index 2 for "msn"
-            'node_id': row[3],  # Use integer index 3 for "node_id"
-            'meter_time': None,
-            'nic_time': None,
-            'rtc_drift': None,
-            'text_code': row[5],  # Use integer index 5 for "text_code"
-            'create_time': row[6],  # Use integer index 6 for "create_time"
-            'update_time': row[7],  # Use integer index 7 for "update_time"
-            'event_time': row[8],  # Ensure event_time is in datetime format
-        }
-        exception_list.append(exception_data)
-
+df = pl.read_excel(r"C:\Users\MustafaMubashir\Downloads\rtc_data.xlsx")
+columns = df.columns
+
+# Parse the payloads and timestamps of all rows at once, the rows which fail go to the exception list
+events, exceptions = parse_rtc_events(df, columns[4], utc_columns=[columns[6], columns[7], columns[8]])
+names = {columns[1]: 'day_local', columns[2]: 'msn', columns[3]: 'node_id', columns[5]: 'text_code',
+         columns[6]: 'create_time', columns[7]: 'update_time', columns[8]: 'event_time'}
+rtc_rows = events.select(*(pl.col(column).alias(name) for column, name in names.items()),
+                         'meter_time', 'nic_time', 'rtc_drift')
+exception_list = exceptions.select(*(pl.col(column).alias(name) for column, name in names.items())).with_columns(
+    meter_time=None, nic_time=None, rtc_drift=None).to_dicts()
+
+inserted = insert_rtc_event_data(rtc_rows)
+if inserted is not None:
+    print(f"Inserted {inserted} of {len(df)} rows")
 print(f"len of master_list : {len(exception_list)}")  # Print the total number of valid rows processed
 
 # Convert the master list to a DataFrame
@@ -1,12 +1,13 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os
 import logging
 from datetime import datetime
 import configparser
 import argparse
-from shlex import quote as shlex_quote
+
+from snippets.kafka_client import KafkaConfig
+from snippets.kafka_client.offset_reset import format_resets, reset_offsets
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger()
@@ -19,11 +20,15 @@ def read_config(config_path):
         if 'kafka' not in config:
             raise ValueError("Missing 'Kafka' section in config file.")
         kafka_config = config['kafka']
-        return {
+        settings = {
             'bootstrap_server': kafka_config.get('bootstrap_server', ''),
-            'group': kafka_config.get('topic_group_id', ''),
-            'topic': kafka_config.get('topic', '')
+            # Comma separated, to reset several groups or topics at once
+            'groups': [group.strip() for group in kafka_config.get('topic_group_id', '').split(',') if group.strip()],
+            'topics': [topic.strip() for topic in kafka_config.get('topic', '').split(',') if topic.strip()]
         }
+        if not settings['groups'] or not settings['topics']:
+            raise ValueError("Missing 'topic_group_id' or 'topic' in the 'kafka' section.")
+        return settings
     except Exception as e:
         logger.error(f"Error reading config file: {e}")
         exit(1)
@@ -33,13 +38,11 @@ def get_datetime(year, month, day):
     time = "00:00:00.000"
     try:
         user_datetime = f"{year}-{month.zfill(2)}-{day.zfill(2)}T{time}"
-        datetime.strptime(user_datetime, "%Y-%m-%dT%H:%M:%S.%f")
+        return datetime.strptime(user_datetime, "%Y-%m-%dT%H:%M:%S.%f")
     except ValueError:
         logger.error("Invalid date format. Please try again.")
         exit(1)
 
-    return user_datetime
-
 
 def main():
     current_year = str(datetime.now().year)
@@ -50,16 +53,19 @@ def main():
     parser.add_argument('--year', type=int, default=int(current_year), help="Year (default: current year)")
     parser.add_argument('--month', type=int, default=int(current_month), help="Month (default: current month)")
     parser.add_argument('--day', type=int, default=int(current_day), help="Day (default: current day)")
+    parser.add_argument('--dry-run', action='store_true', help="Show the new offsets without committing them")
     args = parser.parse_args()
     config = read_config(args.config)
     user_datetime = get_datetime(str(args.year), str(args.month), str(args.day))
-    command = (
-        f"./kafka-consumer-groups.sh --bootstrap-server {config['bootstrap_server']} "
-        f"--group {config['group']} --topic {config['topic']} "
-        f"--reset-offsets --to-datetime {user_datetime} --execute"
-    )
-    logger.info(f"Executing command: {command}")
-    os.system(shlex_quote(command))
+    kafka_config = KafkaConfig(bootstrap_servers=config['bootstrap_server'], topic=config['topics'][0])
+    logger.info(f"Resetting groups {', '.join(config['groups'])} on {', '.join(config['topics'])} "
+                f"to {user_datetime.isoformat()}")
+    try:
+        resets = reset_offsets(kafka_config, config['groups'], config['topics'], user_datetime, args.dry_run)
+    except ValueError as e:
+        logger.error(f"Offset reset failed: {e}")
+        exit(1)
+    print(format_resets(resets))
 
 
 if __name__ == "__main__":